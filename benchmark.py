@@ -0,0 +1,149 @@
+""" Benchmark of all instances in /instances/ with separate timings of every phase and the objective reached in fixed time budgets """
+""" Every run appends its rows to output/benchmark.csv (one row per instance and budget, tagged with run time and git commit) """
+""" and prints the change of each metric against the previous run with the same settings, so speedups and regressions show up """
+""" Usage: python benchmark.py --budgets 10 60 --fss 'NumPy Savings' --lss 'Guided Local Search' (all instances, smallest first) """
+"""        add --profile cprofile tracemalloc to save call statistics and peak memory of every phase (see profiling.py) """
+import argparse
+import os
+import subprocess
+import time as ti
+from glob import glob
+from pandas import DataFrame, read_csv, concat, isna
+from profiling import set_profile_modes
+from route_planning import Scenario, shared_instances
+from utils import generate_vehicles, load_instance
+
+benchmark_file = 'output/benchmark.csv'
+checkpoints = [1, 5, 10, 30, 60, 120, 300, 600] # Seconds of search at which the best objective so far is recorded
+compared_keys = ['Instance', 'Budget [s]', 'FSS', 'LSS', 'Toll [ct]', 'Fleet', 'Seed'] # Settings that have to match for two runs to be compared
+compared_metrics = ['Load_Text [s]', 'Load_Cache [s]', 'Data_Model [s]', 'Model [s]', 'Initial_Solution [s]', 'First_Solution [s]', 'Final_Cost [€]']
+
+
+
+# Function to get the instances in /instances/ sorted by number of nodes (ParisSmall first)
+def get_instances():
+    cities = [os.path.basename(path)[:-len('.nodes')] for path in glob('./instances/*.nodes') if os.path.exists(path[:-len('.nodes')] + '.routes')]
+    return sorted(cities, key=lambda city: len(load_instance(city)['ids']))
+
+
+# Function to get the current git commit of the code, if any
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+# Function to get the best objective of a search trace after some seconds (None if there was no solution yet)
+def get_cost_at(trace, seconds):
+    costs = [entry['Cost [€]'] for entry in trace if entry['Time [s]'] <= seconds]
+    return costs[-1] if costs else None
+
+
+# Function to benchmark one instance with one time budget - returns a result row
+def run_benchmark(city, budget, fleet, toll, fss, lss, seed):
+    start_time = ti.perf_counter()
+    load_instance(city, use_cache=False) # Parsing the .nodes/.routes text files
+    load_text = ti.perf_counter()-start_time
+    start_time = ti.perf_counter()
+    load_instance(city) # Memory-mapping the compiled instance cache (written by the first load if missing)
+    load_cache = ti.perf_counter()-start_time
+    shared_instances.pop(city, None) # So the scenario's own load is measured too
+
+    scenario = Scenario(generate_vehicles(fleet), city, toll, fss, lss, budget, seed)
+    start_time = ti.perf_counter()
+    routes, load, dist, time, cost, fleet_string, params, csv_list = scenario.solve()
+    total = ti.perf_counter()-start_time
+    timings = scenario.timings
+    trace = csv_list[11] if csv_list else []
+    row = {
+        'Instance': city,
+        'Nodes': len(load_instance(city)['ids']),
+        'Budget [s]': budget,
+        'FSS': fss,
+        'LSS': lss,
+        'Toll [ct]': int(toll/10),
+        'Fleet': str(fleet),
+        'Seed': seed,
+        'Load_Text [s]': round(load_text, 4),
+        'Load_Cache [s]': round(load_cache, 4),
+        'Instance [s]': round(timings.get('Instance [s]', 0), 4),
+        'Data_Model [s]': round(timings.get('Data model [s]', 0), 4),
+        'Checks [s]': round(timings.get('Checks [s]', 0), 4),
+        'Model [s]': round(timings.get('Model [s]', 0), 4),
+        'Initial_Solution [s]': round(timings.get('Initial solution [s]', 0), 4),
+        'First_Solution [s]': trace[0]['Time [s]'] if trace else None,
+        'First_Cost [€]': trace[0]['Cost [€]'] if trace else None,
+        'Search [s]': round(timings.get('Search [s]', 0), 3),
+        'Total [s]': round(total, 3),
+        'Final_Cost [€]': csv_list[0] if csv_list else None,
+        'Vehicles': sum(len(route) > 2 for route in csv_list[9]) if csv_list else None,
+        'Solutions': trace[-1]['Solutions'] if trace else 0,
+        'Stop_Reason': csv_list[12] if csv_list else (dist or cost)
+    }
+    for seconds in checkpoints:
+        if seconds < budget:
+            row[f'Cost@{seconds}s [€]'] = get_cost_at(trace, seconds)
+    return row
+
+
+# Function to append the rows of a run to a results file (e.g. output/benchmark.csv) - returns all runs in the file
+def append_runs(rows, output):
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    runs = DataFrame(rows)
+    if os.path.exists(output):
+        runs = concat([read_csv(output, sep=';'), runs], ignore_index=True)
+    runs.to_csv(output, index=False, sep=';')
+    return runs
+
+
+# Function to print the change of every compared metric against the previous run with the same settings (keys)
+def compare_runs(runs, run_id, keys=compared_keys, metrics=compared_metrics):
+    current = runs[runs['Run'] == run_id]
+    for _, row in current.iterrows():
+        previous = runs[(runs['Run'] != run_id) & (runs['Run'] < run_id)]
+        for key in keys:
+            previous = previous[previous[key].isna()] if isna(row[key]) else previous[previous[key] == row[key]] # Missing settings (e.g. default seed) match each other
+        if previous.empty:
+            continue
+        before = previous.iloc[-1]
+        changes = []
+        for metric in metrics:
+            if not isna(before[metric]) and not isna(row[metric]) and before[metric]: # Skip missing (None/NaN) values
+                changes.append(f'{metric} {row[metric]} ({(row[metric]/before[metric]-1)*100:+.1f}%)')
+        print(f'{row["Instance"]} t={row["Budget [s]"]}s vs. run {before["Run"]} ({before["Commit"]}): ' + ', '.join(changes))
+
+
+# Function to run the benchmark over all instances and budgets and append the results to the benchmark file
+def run_suite(cities, budgets, fleet, toll, fss, lss, seed, output=benchmark_file):
+    run_id = ti.strftime('%Y-%m-%d %H:%M:%S')
+    commit = get_commit()
+    rows = []
+    for city in cities:
+        for budget in budgets:
+            print(f'\n### Benchmark {city} with t={budget}s')
+            rows.append({'Run': run_id, 'Commit': commit} | run_benchmark(city, budget, fleet, toll, fss, lss, seed))
+            print(', '.join(f'{key}: {value}' for key, value in rows[-1].items() if key.endswith('[s]') or key.endswith('[€]')))
+
+    runs = append_runs(rows, output)
+    print(f'\nResults of {len(rows)} benchmarks appended to {output}')
+    compare_runs(runs, run_id)
+    return rows
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark load, build and search times and the objective reached on all instances')
+    parser.add_argument('--instances', nargs='+', help='instances to run (defaults to all in /instances/)')
+    parser.add_argument('--budgets', nargs='+', type=int, default=[10, 60], help='search time budgets in seconds')
+    parser.add_argument('--fleet', nargs=7, type=int, default=[20]*7, metavar='N', help='vehicles per type 1-7')
+    parser.add_argument('--toll', type=int, default=200, help='toll in 0.1ct/km')
+    parser.add_argument('--fss', default='Automatic FSS')
+    parser.add_argument('--lss', default='Guided Local Search')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=benchmark_file)
+    parser.add_argument('--profile', nargs='+', choices=['cprofile', 'tracemalloc'], help='profile every solve (same as ROUTE_PROFILE, see profiling.py)')
+    args = parser.parse_args()
+    if args.profile:
+        set_profile_modes(args.profile)
+    run_suite(args.instances or get_instances(), args.budgets, args.fleet, args.toll, args.fss, args.lss, args.seed, args.output)
@@ -0,0 +1,207 @@
+""" Loader for CVRPLIB instances (.vrp) and solutions (.sol), e.g. the Uchoa et al. X set from http://vrp.galgos.inf.puc-rio.br """
+""" An instance becomes the same data model route_planning uses: one carrier type with the instance's capacity, unlimited range and time, """
+""" and cost per km chosen so that the solver's cost equals the CVRPLIB objective (rounded distances) """
+""" Gap benchmark: python cvrplib.py X-n101-k25.vrp X-n200-k36.vrp --fss 'NumPy Savings' 'Automatic FSS' --lss 'Guided Local Search' --budget 60 """
+"""    compares the objective over time with the best known solution of <name>.sol next to each .vrp and appends to output/cvrplib.csv """
+import argparse
+import os
+import time as ti
+from itertools import product
+from numpy import array, asarray, ceil, floor, int64, maximum, sqrt, zeros, triu_indices, tril_indices
+from pandas import DataFrame
+from benchmark import append_runs, checkpoints, compare_runs, get_commit, get_cost_at
+from route_planning import Scenario
+
+cvrplib_file = 'output/cvrplib.csv'
+cvrplib_keys = ['Instance', 'Budget [s]', 'FSS', 'LSS', 'Seed'] # Settings that have to match for two runs to be compared
+cvrplib_metrics = ['Model [s]', 'First_Solution [s]', 'Final_Gap [%]', 'Time_to_1% [s]']
+cvrplib_range = 10**9 # Range and volume large enough to never limit a CVRPLIB route
+
+
+
+# Function to read the header entries and sections of a .vrp file
+def read_vrp(path):
+    header = {}
+    sections = {}
+    section = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line == 'EOF':
+                continue
+            if line.endswith('_SECTION'):
+                section = line
+                sections[section] = []
+            elif ':' in line and section is None:
+                key, value = line.split(':', 1)
+                header[key.strip()] = value.strip().strip('"')
+            elif section is not None:
+                sections[section] += line.split()
+    return header, sections
+
+
+# Function to compute the distance matrix of a .vrp file the way CVRPLIB does (EUC_2D rounds to the nearest integer, CEIL_2D rounds up)
+def get_vrp_distances(header, sections, coordinates, dimension):
+    edge_weight_type = header.get('EDGE_WEIGHT_TYPE', 'EUC_2D')
+    if edge_weight_type in ['EUC_2D', 'CEIL_2D']:
+        euclidean = sqrt(((coordinates[:, None, :] - coordinates[None, :, :])**2).sum(axis=2))
+        return (floor(euclidean + 0.5) if edge_weight_type == 'EUC_2D' else ceil(euclidean)).astype(int64)
+    if edge_weight_type != 'EXPLICIT':
+        raise ValueError(f'Unsupported EDGE_WEIGHT_TYPE {edge_weight_type}')
+
+    weights = asarray([float(value) for value in sections['EDGE_WEIGHT_SECTION']]).round().astype(int64)
+    edge_weight_format = header.get('EDGE_WEIGHT_FORMAT', 'FULL_MATRIX')
+    distances = zeros((dimension, dimension), dtype=int64)
+    match edge_weight_format:
+        case 'FULL_MATRIX':
+            distances = weights.reshape(dimension, dimension)
+        case 'LOWER_ROW':
+            distances[tril_indices(dimension, -1)] = weights
+        case 'LOWER_DIAG_ROW':
+            distances[tril_indices(dimension)] = weights
+        case 'UPPER_ROW':
+            distances[triu_indices(dimension, 1)] = weights
+        case 'UPPER_DIAG_ROW':
+            distances[triu_indices(dimension)] = weights
+        case _:
+            raise ValueError(f'Unsupported EDGE_WEIGHT_FORMAT {edge_weight_format}')
+    return maximum(distances, distances.T) # Mirrors triangular formats (CVRPLIB distances are symmetric)
+
+
+# Function to load a CVRPLIB .vrp file as instance (same arrays as utils.load_instance) with its name and vehicle capacity
+# The depot has to be the first node, as in all CVRPLIB sets (node numbers of .sol files count customers from 1 after it)
+def load_vrp(path):
+    header, sections = read_vrp(path)
+    if header.get('TYPE', 'CVRP') != 'CVRP':
+        raise ValueError(f'{path} is of type {header["TYPE"]}, only CVRP is supported')
+    dimension = int(header['DIMENSION'])
+    capacity = int(header['CAPACITY'])
+    depots = [int(value) for value in sections.get('DEPOT_SECTION', ['1', '-1']) if int(value) > 0]
+    if depots != [1]:
+        raise ValueError(f'{path} has depot(s) {depots}, only a single depot at node 1 is supported')
+
+    demands = array([int(value) for value in sections['DEMAND_SECTION']]).reshape(dimension, 2)[:, 1]
+    if 'NODE_COORD_SECTION' in sections:
+        coordinates = array([float(value) for value in sections['NODE_COORD_SECTION']]).reshape(dimension, 3)[:, 1:]
+    else:
+        coordinates = zeros((dimension, 2))
+    distances = get_vrp_distances(header, sections, coordinates, dimension)
+    instance = {
+        'ids': array(['Depot'] + [f'C{node}' for node in range(1, dimension)]),
+        'lon': coordinates[:, 0],
+        'lat': coordinates[:, 1],
+        'demands_kg': demands.astype(int64),
+        'demands_liter': zeros(dimension, dtype=int64),
+        'service_times': zeros(dimension, dtype=int64),
+        'distance_total': distances,
+        'distance_inside': zeros((dimension, dimension), dtype=int64),
+        'distance_outside': distances,
+        'time_routes': zeros((dimension, dimension), dtype=int64)
+    }
+    return instance, header.get('NAME', os.path.basename(path)[:-len('.vrp')]), capacity
+
+
+# Function to load a CVRPLIB .sol file - returns its routes (lists of nodes incl. depot, like csv_list[9]) and cost
+def load_sol(path):
+    routes = []
+    cost = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.lower().startswith('route'):
+                routes.append([0] + [int(node) for node in line.split(':', 1)[1].split()] + [0])
+            elif line.lower().startswith('cost'):
+                cost = float(line.split()[1])
+    return routes, cost
+
+
+# Function to get the carrier table of a CVRPLIB instance: one type with its capacity [units as kg], unlimited volume and range,
+# and 1000 0.1ct/km, so that the solver's cost of a route is exactly its CVRPLIB length
+def get_cvrplib_carriers(capacity):
+    return {'ids': [1], 'payloads': [capacity*1000], 'volumes': [cvrplib_range], 'ranges': [cvrplib_range], 'cpkm_outside': [1000], 'cpkm_inside': [1000]}
+
+
+# Function to get the scenario of a CVRPLIB instance (one vehicle per customer, the fleet pruning keeps the ones that can be used)
+def get_cvrplib_scenario(path, fss, lss, timeout, seed=None):
+    instance, name, capacity = load_vrp(path)
+    vehicles = [1] * max(1, len(instance['ids'])-1)
+    return Scenario(vehicles, name, 0, fss, lss, timeout, seed, instance=instance, carriers=get_cvrplib_carriers(capacity))
+
+
+# Function to get the length of routes on an instance (to check the distance convention against a .sol file)
+def get_routes_length(instance, routes):
+    return sum(int(instance['distance_total'][route[:-1], route[1:]].sum()) for route in routes)
+
+
+# Function to solve a CVRPLIB instance with one FSS/LSS and report the gap to the best known solution over time
+def run_gap_benchmark(path, fss, lss, budget, seed=None):
+    scenario = get_cvrplib_scenario(path, fss, lss, budget, seed)
+    best_known = None
+    solution_path = path[:-len('.vrp')] + '.sol'
+    if os.path.exists(solution_path):
+        routes, best_known = load_sol(solution_path)
+        length = get_routes_length(scenario.instance, routes)
+        if best_known is not None and length != round(best_known):
+            print(f'Warning: routes of {solution_path} have length {length} on the loaded instance, but cost {best_known}')
+
+    start_time = ti.perf_counter()
+    csv_list = scenario.solve()[7]
+    wall_time = ti.perf_counter()-start_time
+    trace = [{'Time [s]': entry['Time [s]'], 'Cost [€]': entry['Cost [€]']*1000} for entry in csv_list[11]] if csv_list else [] # Back to CVRPLIB units
+    def gap(cost):
+        return round((cost/best_known-1)*100, 3) if best_known and cost is not None else None
+
+    row = {
+        'Instance': scenario.city,
+        'Customers': len(scenario.instance['ids'])-1,
+        'Capacity': scenario.carriers['payloads'][0]//1000,
+        'Best_Known': best_known,
+        'FSS': fss,
+        'LSS': lss,
+        'Budget [s]': budget,
+        'Seed': seed,
+        'Wall_Time [s]': round(wall_time, 3),
+        'Model [s]': round(scenario.timings.get('Data model [s]', 0) + scenario.timings.get('Model [s]', 0), 3),
+        'First_Solution [s]': trace[0]['Time [s]'] if trace else None,
+        'First_Gap [%]': gap(trace[0]['Cost [€]']) if trace else None,
+        'Final_Cost': trace[-1]['Cost [€]'] if trace else None,
+        'Final_Gap [%]': gap(trace[-1]['Cost [€]']) if trace else None,
+        'Routes': sum(len(route) > 2 for route in csv_list[9]) if csv_list else None
+    }
+    for seconds in checkpoints:
+        if seconds < budget:
+            row[f'Gap@{seconds}s [%]'] = gap(get_cost_at(trace, seconds))
+    for target in [5, 2, 1]:
+        reached = [entry['Time [s]'] for entry in trace if best_known and entry['Cost [€]'] <= best_known * (1+target/100)]
+        row[f'Time_to_{target}% [s]'] = reached[0] if reached else None
+    return row
+
+
+# Function to run the gap benchmark over instances and FSS/LSS combinations and append the results to the CVRPLIB benchmark file
+# (compared with the previous run of the same settings like benchmark.py does)
+def run_suite(paths, fss_list, lss_list, budget, seed=None, output=cvrplib_file):
+    run_id = ti.strftime('%Y-%m-%d %H:%M:%S')
+    commit = get_commit()
+    rows = []
+    for path, fss, lss in product(paths, fss_list, lss_list):
+        print(f'\n### CVRPLIB {os.path.basename(path)} with {fss} + {lss}, t={budget}s')
+        rows.append({'Run': run_id, 'Commit': commit} | run_gap_benchmark(path, fss, lss, budget, seed))
+        print(f'Cost {rows[-1]["Final_Cost"]} vs. best known {rows[-1]["Best_Known"]}: gap {rows[-1]["Final_Gap [%]"]}%')
+
+    runs = append_runs(rows, output)
+    print(f'\nResults of {len(rows)} runs appended to {output}')
+    print(DataFrame(rows)[['Instance', 'FSS', 'LSS', 'Final_Gap [%]', 'First_Solution [s]', 'Time_to_1% [s]']].to_string(index=False))
+    compare_runs(runs, run_id, cvrplib_keys, cvrplib_metrics)
+    return rows
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark search settings on CVRPLIB instances by their gap to the best known solutions')
+    parser.add_argument('instances', nargs='+', help='.vrp files (best known solutions are read from .sol files next to them)')
+    parser.add_argument('--fss', nargs='+', default=['Automatic FSS'])
+    parser.add_argument('--lss', nargs='+', default=['Guided Local Search'])
+    parser.add_argument('--budget', type=int, default=60, help='time limit per run in seconds')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', default=cvrplib_file)
+    args = parser.parse_args()
+    run_suite(args.instances, args.fss, args.lss, args.budget, args.seed, args.output)
@@ -0,0 +1,141 @@
+""" Cluster-first/route-second decomposition for large instances """
+""" Customers are partitioned geographically (k-means on Lon/Lat) or by matrix proximity (k-medoids on the distance matrix), """
+""" every cluster is solved as an independent sub-CVRP with its share of the fleet in parallel processes, and the stitched routes """
+""" are improved by a short warm-started search over the whole instance, which moves customers across cluster borders """
+""" Usage: python decomposition.py --city Shanghai --fleet 20 20 20 20 20 20 20 --timeout 600 --clusters 4 --method geo """
+import argparse
+import multiprocessing as mp
+import os
+import time as ti
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil, cos, radians
+from numpy import asarray, array, column_stack, concatenate, flatnonzero, ix_, zeros
+from route_planning import Scenario, get_shared_instance
+from result_store import write_result
+from utils import count_occurrences, generate_vehicles, instance_arrays
+
+customers_per_cluster = 60 # Default cluster size, small enough for the solver to find good routes quickly
+
+
+
+# Function to pick k well spread start centres - the point farthest from the depot, then repeatedly the one farthest from all chosen
+def get_farthest_points(depot_distances, distances, k):
+    chosen = [int(depot_distances.argmax())]
+    nearest = distances[chosen[0]].copy()
+    while len(chosen) < k:
+        chosen.append(int(nearest.argmax()))
+        nearest = nearest.clip(max=distances[chosen[-1]])
+    return chosen
+
+
+# Function to cluster customers by k-means on their coordinates (longitudes scaled to the same length as latitudes)
+def cluster_geographic(instance, k, iterations=50):
+    lat = asarray(instance['lat'][1:], dtype=float)
+    points = column_stack([asarray(instance['lon'][1:], dtype=float) * cos(radians(lat.mean())), lat])
+    distances = ((points[:, None, :] - points[None, :, :])**2).sum(axis=2)
+    depot = array([float(instance['lon'][0]) * cos(radians(lat.mean())), float(instance['lat'][0])])
+    centres = points[get_farthest_points(((points - depot)**2).sum(axis=1), distances, k)]
+    labels = zeros(len(points), dtype=int)
+    for _ in range(iterations):
+        labels = ((points[:, None, :] - centres[None, :, :])**2).sum(axis=2).argmin(axis=1)
+        new_centres = array([points[labels == c].mean(axis=0) if (labels == c).any() else centres[c] for c in range(k)])
+        if (new_centres == centres).all():
+            break
+        centres = new_centres
+    return labels
+
+
+# Function to cluster customers by k-medoids on the (symmetrised) road distances between them
+def cluster_matrix(instance, k, iterations=50):
+    distances = asarray(instance['distance_total'], dtype=float)
+    distances = (distances + distances.T) / 2
+    depot_distances, distances = distances[0, 1:], distances[1:, 1:]
+    medoids = get_farthest_points(depot_distances, distances, k)
+    labels = zeros(len(distances), dtype=int)
+    for _ in range(iterations):
+        labels = distances[:, medoids].argmin(axis=1)
+        new_medoids = [int(members[distances[ix_(members, members)].sum(axis=0).argmin()]) if len(members) else medoids[c]
+                       for c, members in ((c, flatnonzero(labels == c)) for c in range(k))]
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+    return labels
+
+
+# Function to partition the customers of an instance into clusters - returns a list of node arrays, each with the depot first
+def get_clusters(instance, k, method='geo'):
+    labels = cluster_geographic(instance, k) if method == 'geo' else cluster_matrix(instance, k)
+    return [concatenate([[0], flatnonzero(labels == c) + 1]) for c in range(k) if (labels == c).any()]
+
+
+# Function to cut the sub-instance of some nodes (depot first) out of an instance
+def get_sub_instance(instance, nodes):
+    return {name: asarray(instance[name])[ix_(nodes, nodes)] if asarray(instance[name]).ndim == 2 else asarray(instance[name])[nodes] for name in instance_arrays}
+
+
+# Function to split the fleet between clusters by their share of the weight and volume demand (rounded up, so a cluster never gets too few)
+def split_fleet(vehicles, instance, clusters):
+    weight, volume = asarray(instance['demands_kg'], dtype=float), asarray(instance['demands_liter'], dtype=float)
+    fleets = []
+    for nodes in clusters:
+        share = max(weight[nodes].sum() / weight.sum(), volume[nodes].sum() / volume.sum(), (len(nodes)-1) / (len(weight)-1))
+        fleets.append(generate_vehicles([ceil(count_occurrences(vehicles).get(vehicle_type, 0) * share) for vehicle_type in range(1, 8)]))
+    return fleets
+
+
+# Function to solve one cluster - runs in a worker process
+def solve_cluster(variables, sub_instance, timeout):
+    vehicles, city, toll, fss, lss, seed = variables
+    return Scenario(vehicles, city, toll, fss, lss, timeout, seed, instance=sub_instance).solve()
+
+
+# Function to solve a scenario by decomposition, returns the same as Scenario.solve()
+# The clusters share (1-improve_share) of the scenario's timeout, the rest is spent on the warm-started search over the whole instance
+def solve_decomposed(scenario, clusters=None, method='geo', workers=None, improve_share=0.2):
+    instance = scenario.instance if scenario.instance is not None else get_shared_instance(scenario.city)
+    clusters = get_clusters(instance, clusters or ceil((len(instance['ids'])-1) / customers_per_cluster), method)
+    fleets = split_fleet(scenario.vehicles, instance, clusters)
+    workers = min(workers or mp.cpu_count(), len(clusters))
+    cluster_timeout = max(1, int(scenario.timeout * (1-improve_share)) // ceil(len(clusters)/workers))
+    print(f'\nDecomposing {scenario.city} into {len(clusters)} clusters of {[len(nodes)-1 for nodes in clusters]} customers, solved with t={cluster_timeout}s each')
+
+    variables = [(fleet, scenario.city, scenario.toll, scenario.fss_string, scenario.lss_string, scenario.seed) for fleet in fleets]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as pool:
+        results = list(pool.map(solve_cluster, variables, [get_sub_instance(instance, nodes) for nodes in clusters], [cluster_timeout]*len(clusters)))
+
+    # Stitch the routes of all clusters back into node numbers of the whole instance (customers of unsolved clusters are inserted by the warm start)
+    routes = []
+    types = []
+    for nodes, result in zip(clusters, results):
+        csv_list = result[7]
+        if not csv_list:
+            print(f'Cluster of {len(nodes)-1} customers could not be solved: {result[2] or result[4]}')
+            continue
+        routes += [[int(nodes[node]) for node in route] for route in csv_list[9]]
+        types += list(csv_list[8])
+    print(f'Stitched {len(routes)} routes of {sum(bool(result[7]) for result in results)} clusters at {sum(result[7][0] for result in results if result[7]):.3f}€, improving across cluster borders')
+    return scenario.solve(initial_routes=routes, initial_types=types, time_limit=max(1, int(scenario.timeout * improve_share)))
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve a large routing scenario by cluster-first/route-second decomposition')
+    parser.add_argument('--city', required=True)
+    parser.add_argument('--fleet', nargs=7, type=int, default=[20]*7, metavar='N', help='vehicles per type 1-7')
+    parser.add_argument('--toll', type=int, default=0, help='toll in 0.1ct/km')
+    parser.add_argument('--fss', default='Automatic FSS')
+    parser.add_argument('--lss', default='Guided Local Search')
+    parser.add_argument('--timeout', type=int, default=600)
+    parser.add_argument('--clusters', type=int, help=f'number of clusters (defaults to one per {customers_per_cluster} customers)')
+    parser.add_argument('--method', choices=['geo', 'matrix'], default='geo', help='cluster by Lon/Lat (geo) or by road distances (matrix)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--improve-share', type=float, default=0.2, help='share of the timeout for the search over the whole instance')
+    args = parser.parse_args()
+
+    scenario = Scenario(generate_vehicles(args.fleet), args.city, args.toll, args.fss, args.lss, args.timeout)
+    start_time = ti.time()
+    routes, load, dist, time, cost, fleet, params, csv_list = solve_decomposed(scenario, args.clusters, args.method, args.workers, args.improve_share)
+    run_time = round(ti.time()-start_time, 3)
+    print(f'{params}\n{cost}\n{fleet}\nTime: {run_time}s')
+    if csv_list:
+        print(write_result(csv_list, args.city, int(args.toll/10), args.fss, args.lss, args.timeout, run_time, scenario.vehicles))
@@ -0,0 +1,214 @@
+""" Distance and time matrices estimated from the coordinates of a .nodes file, for new cities or order sets without a .routes file """
+""" Road distances are great circle distances times a detour factor of the city, travel times a fixed time per arc plus the distance at the city's speed, """
+""" and the km inside the toll zone are the part of each arc within the city's toll-zone polygon. Factors and polygons are calibrated """
+""" against the real matrices of Paris, NewYork and Shanghai and kept in instances/calibration.json (a polygon can be replaced by an official boundary) """
+""" Calibrate: python estimation.py --calibrate Paris NewYork Shanghai; compare estimated and real matrices: python estimation.py --check Paris """
+import argparse
+import json
+import os
+from numpy import arange, arcsin, asarray, clip, concatenate, cos, degrees, diff, errstate, int32, linspace, ones, pi, radians, rint, sin, sort, sqrt, stack, where, zeros
+from numpy.linalg import lstsq
+from utils import get_nodes, get_time_list_from_nodes, load_instance
+
+earth_radius = 6371000 # [m]
+calibration_file = './instances/calibration.json'
+estimate_block_nodes = 200 # Origins whose arcs are estimated at once (bounds the memory of the polygon intersections)
+zone_vertices = 16 # Vertices of fitted toll-zone polygons
+zone_min_radius = 0.25 # Smallest distance of a fitted vertex from the centre, as share of that of the initial regular polygon
+zone_max_ratio = 2.0 # Largest ratio between the distances of neighbouring vertices from the centre (keeps the polygon from collapsing into slivers)
+
+
+
+# Function to project coordinates to metres on a plane around a latitude (accurate to well below a percent within a city)
+def get_local_xy(lon, lat, lat0):
+    return radians(asarray(lon, dtype=float)) * cos(radians(lat0)) * earth_radius, radians(asarray(lat, dtype=float)) * earth_radius
+
+
+# Function to get the great circle distances [m] from each origin (rows) to each destination (columns)
+def get_haversine(lon_from, lat_from, lon_to, lat_to):
+    lon_from, lat_from, lon_to, lat_to = (radians(asarray(values, dtype=float)) for values in [lon_from, lat_from, lon_to, lat_to])
+    a = sin((lat_to[None, :]-lat_from[:, None])/2)**2 + cos(lat_from[:, None])*cos(lat_to[None, :])*sin((lon_to[None, :]-lon_from[:, None])/2)**2
+    return 2 * earth_radius * arcsin(sqrt(clip(a, 0, 1)))
+
+
+# Function to check which points lie inside a polygon (ray casting, polygon given by its vertices vx/vy)
+def point_in_polygon(x, y, vx, vy):
+    inside = zeros(len(x), dtype=bool)
+    for i in range(len(vx)):
+        j = i-1
+        with errstate(divide='ignore', invalid='ignore'):
+            inside ^= ((vy[i] > y) != (vy[j] > y)) & (x < (vx[j]-vx[i]) * (y-vy[i]) / (vy[j]-vy[i]) + vx[i])
+    return inside
+
+
+# Function to get the share of every straight arc from the origins (rows) to the destinations (columns) that lies within a polygon
+# Each arc is cut at its crossings with the polygon's edges; the pieces are alternately inside and outside, starting as its origin
+def get_polygon_share(x_from, y_from, x_to, y_to, vx, vy):
+    dx = x_to[None, :] - x_from[:, None]
+    dy = y_to[None, :] - y_from[:, None]
+    crossings = []
+    for i in range(len(vx)):
+        ex, ey = vx[i]-vx[i-1], vy[i]-vy[i-1]
+        ax, ay = (vx[i-1]-x_from)[:, None], (vy[i-1]-y_from)[:, None]
+        denominator = dx*ey - dy*ex
+        with errstate(divide='ignore', invalid='ignore'):
+            t = (ax*ey - ay*ex) / denominator # Position of the crossing on the arc
+            u = (ax*dy - ay*dx) / denominator # Position of the crossing on the edge
+        crossings.append(where((denominator != 0) & (t > 0) & (t < 1) & (u >= 0) & (u < 1), t, 1.0))
+    cuts = sort(stack(crossings, axis=2), axis=2)
+    pieces = diff(concatenate([zeros(cuts.shape[:2] + (1,)), cuts, ones(cuts.shape[:2] + (1,))], axis=2), axis=2)
+    starts_inside = point_in_polygon(x_from, y_from, vx, vy)
+    inside = starts_inside[:, None, None] == (arange(pieces.shape[2]) % 2 == 0)[None, None, :]
+    return (pieces * inside).sum(axis=2)
+
+
+# Function to get the toll-zone polygon of a calibration in metres on a plane around a latitude (None, None without toll zone)
+def get_zone_xy(calibration, lat0):
+    if not calibration.get('zone'):
+        return None, None
+    zone = asarray(calibration['zone'], dtype=float)
+    return get_local_xy(zone[:, 0], zone[:, 1], lat0)
+
+
+# Function to estimate the total and inside distances [m] and times [s] of the arcs from some origins (block) to all nodes with the factors of a calibration
+# x/y and the zone polygon vx/vy are in metres around the same latitude
+def estimate_arcs(lon, lat, x, y, block, calibration, vx, vy):
+    total = rint(get_haversine(lon[block], lat[block], lon, lat) * calibration['detour'])
+    inside = rint(total * get_polygon_share(x[block], y[block], x, y, vx, vy)) if vx is not None else zeros(total.shape)
+    return total, inside, where(total > 0, rint(calibration['time_offset'] + total / calibration['speed']), 0)
+
+
+# Function to estimate the distance [m] and time [s] matrices of nodes from their coordinates with the factors of a calibration
+def estimate_matrices(lon, lat, calibration):
+    lon, lat = asarray(lon, dtype=float), asarray(lat, dtype=float)
+    num_nodes = len(lon)
+    x, y = get_local_xy(lon, lat, lat[0])
+    vx, vy = get_zone_xy(calibration, lat[0])
+    matrices = {name: zeros((num_nodes, num_nodes), dtype=int32) for name in ['distance_total', 'distance_inside', 'distance_outside', 'time_routes']}
+    for start in range(0, num_nodes, estimate_block_nodes):
+        block = slice(start, min(start+estimate_block_nodes, num_nodes))
+        total, inside, time = estimate_arcs(lon, lat, x, y, block, calibration, vx, vy)
+        matrices['distance_total'][block] = total
+        matrices['distance_inside'][block] = inside
+        matrices['distance_outside'][block] = total - inside
+        matrices['time_routes'][block] = time
+    return matrices
+
+
+# Function to fit a toll-zone polygon to the inside km of an instance: a regular polygon centred on the nodes whose arcs run most inside,
+# sized to the instance's share of inside km, whose vertices are then moved in and out one at a time while that lowers the error of the inside km
+# (within bounds on their distance from the centre and to that of their neighbours)
+def fit_zone_polygon(instance, x, y, iterations=6):
+    total = asarray(instance['distance_total'], dtype=float)
+    inside = asarray(instance['distance_inside'], dtype=float)
+    share = (inside.sum(axis=1) + inside.sum(axis=0)) / (total.sum(axis=1) + total.sum(axis=0)).clip(1) # Share of inside km of the arcs of each node
+    weights = share**2 if share.any() else ones(len(x))
+    centre_x, centre_y = (weights*x).sum() / weights.sum(), (weights*y).sum() / weights.sum()
+    angles = linspace(0, 2*pi, zone_vertices, endpoint=False)
+
+    def get_polygon(radii):
+        return centre_x + radii*cos(angles), centre_y + radii*sin(angles)
+
+    def get_error(radii):
+        return abs(get_polygon_share(x, y, x, y, *get_polygon(radii)) * total - inside).sum()
+
+    low, high = 0.0, 2 * float(sqrt((x-centre_x)**2 + (y-centre_y)**2).max())
+    for _ in range(25):
+        radius = (low+high) / 2
+        if (get_polygon_share(x, y, x, y, *get_polygon(ones(zone_vertices)*radius)) * total).sum() < inside.sum():
+            low = radius
+        else:
+            high = radius
+    radii = ones(zone_vertices) * (low+high) / 2
+    min_radius = zone_min_radius * radii[0]
+    error = get_error(radii)
+    for _ in range(iterations):
+        for vertex in range(zone_vertices):
+            for factor in [0.5, 0.7, 0.85, 0.95, 1.05, 1.2, 1.4, 2.0]:
+                trial = radii.copy()
+                trial[vertex] *= factor
+                neighbours = trial[[vertex-1, (vertex+1) % zone_vertices]]
+                if trial[vertex] < min_radius or (trial[vertex] > zone_max_ratio*neighbours).any() or (neighbours > zone_max_ratio*trial[vertex]).any():
+                    continue
+                trial_error = get_error(trial)
+                if trial_error < error:
+                    radii, error = trial, trial_error
+    return get_polygon(radii)
+
+
+# Function to calibrate the estimation factors and toll-zone polygon of a city against its real matrices
+def calibrate_city(city):
+    instance = load_instance(city)
+    lon, lat = asarray(instance['lon'], dtype=float), asarray(instance['lat'], dtype=float)
+    straight = get_haversine(lon, lat, lon, lat)
+    total = asarray(instance['distance_total'], dtype=float)
+    time = asarray(instance['time_routes'], dtype=float)
+    arcs = straight > 0
+    time_offset, seconds_per_metre = lstsq(stack([ones(arcs.sum()), total[arcs]], axis=1), time[arcs], rcond=None)[0]
+    x, y = get_local_xy(lon, lat, lat[0])
+    vx, vy = fit_zone_polygon(instance, x, y)
+    zone_lon = degrees(vx / (cos(radians(lat[0])) * earth_radius))
+    zone_lat = degrees(vy / earth_radius)
+    return {
+        'detour': round(float(total[arcs].sum() / straight[arcs].sum()), 4),
+        'time_offset': round(float(time_offset), 1), # [s]
+        'speed': round(float(1 / seconds_per_metre), 3), # [m/s]
+        'zone': [[round(float(point_lon), 6), round(float(point_lat), 6)] for point_lon, point_lat in zip(zone_lon, zone_lat)]
+    }
+
+
+# Function to get the calibration of a city: that of the longest calibrated name it starts with (e.g. Paris for ParisSmall),
+# otherwise the mean factors of all calibrated cities without a toll zone
+def get_calibration(city):
+    with open(calibration_file, encoding='utf-8') as f:
+        calibrations = json.load(f)
+    matches = [name for name in calibrations if city.startswith(name)]
+    if matches:
+        return calibrations[max(matches, key=len)]
+    print(f'No calibration for {city}, using mean factors of {list(calibrations)} and no toll zone')
+    return {factor: sum(calibration[factor] for calibration in calibrations.values()) / len(calibrations) for factor in ['detour', 'time_offset', 'speed']} | {'zone': None}
+
+
+# Function to build the instance of a city from its .nodes file alone (same arrays as utils.load_instance)
+def estimate_instance(city):
+    nodes = get_nodes(city)
+    print(f'No routes for {city}, estimating distances and times of {len(nodes.index)} nodes from their coordinates')
+    return {
+        'ids': asarray(nodes['Id'].values, dtype=str),
+        'lon': asarray(nodes['Lon'].values, dtype=float),
+        'lat': asarray(nodes['Lat'].values, dtype=float),
+        'demands_kg': asarray(nodes['Demand[kg]'].values, dtype=int32),
+        'demands_liter': asarray(nodes['Demand[m^3*10^-3]'].values, dtype=int32),
+        'service_times': get_time_list_from_nodes(nodes)
+    } | estimate_matrices(nodes['Lon'].values, nodes['Lat'].values, get_calibration(city))
+
+
+# Function to print how far the estimated matrices of an instance are from its real ones
+def check_estimate(city):
+    instance = load_instance(city)
+    estimate = estimate_matrices(instance['lon'], instance['lat'], get_calibration(city))
+    for name in ['distance_total', 'distance_inside', 'time_routes']:
+        real = asarray(instance[name], dtype=float)
+        error = abs(estimate[name] - real).sum() / real.sum()
+        print(f'{city} {name}: estimated total {estimate[name].sum()/real.sum()*100:.1f}% of real, mean absolute error per arc {error*100:.1f}% of real')
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrate or check distance/time estimation from coordinates')
+    parser.add_argument('--calibrate', nargs='+', metavar='CITY', help='fit factors and toll zones to the real matrices of these cities')
+    parser.add_argument('--check', nargs='+', metavar='CITY', help='compare estimated and real matrices of these instances')
+    args = parser.parse_args()
+    if args.calibrate:
+        calibrations = {}
+        if os.path.exists(calibration_file):
+            with open(calibration_file, encoding='utf-8') as f:
+                calibrations = json.load(f)
+        for city in args.calibrate:
+            calibrations[city] = calibrate_city(city)
+            print(f'{city}: ' + ', '.join(f'{key} {value}' for key, value in calibrations[city].items() if key != 'zone'))
+        with open(calibration_file, 'w', encoding='utf-8') as f:
+            json.dump(calibrations, f, indent=1)
+        print(f'Calibration written to {calibration_file}')
+    for city in args.check or []:
+        check_estimate(city)
@@ -0,0 +1,120 @@
+""" Generator of synthetic scale-test instances in the .nodes/.routes format of /instances/ """
+""" Customers are sampled around the customers of a real instance (same depot, spread, demands and service times), road distances, """
+""" travel times and km inside the toll zone are estimated like those of a city without .routes file, with the calibration of the real instance's city """
+""" (detour factor, time per arc, speed and toll-zone polygon, see estimation.py). The .routes file is written in blocks of rows, so memory stays small for any size """
+""" Usage: python generate_instance.py --like Shanghai --customers 3000 --name Shanghai3000 --seed 1 --compile """
+"""    (--compile also builds the binary instance cache at /instances/.cache/, see utils.load_instance) """
+import argparse
+import os
+import time as ti
+from numpy import asarray, char, cos, degrees, fill_diagonal, int64, median, radians, repeat, roll, tile
+from numpy.random import default_rng
+from pandas import DataFrame
+from utils import load_instance
+from estimation import earth_radius, estimate_arcs, get_calibration, get_haversine, get_local_xy, get_zone_xy
+
+routes_block_nodes = 100 # Origins whose rows of the .routes file are computed and written at once
+
+
+
+# Function to get everything the generator takes from a real instance and the calibration of its city
+def get_profile(city):
+    instance = load_instance(city)
+    lon, lat = asarray(instance['lon'], dtype=float), asarray(instance['lat'], dtype=float)
+    x, y = get_local_xy(lon, lat, lat[0])
+    neighbours = get_haversine(lon[1:], lat[1:], lon[1:], lat[1:])
+    fill_diagonal(neighbours, float('inf'))
+    calibration = get_calibration(city)
+    return {
+        'city': city,
+        'x': x,
+        'y': y,
+        'lat0': lat[0],
+        'demands_kg': asarray(instance['demands_kg'])[1:],
+        'demands_liter': asarray(instance['demands_liter'])[1:],
+        'service_times': asarray(instance['service_times'])[1:],
+        'jitter': float(median(neighbours.min(axis=1))), # Typical distance between neighbouring customers [m]
+        'calibration': calibration,
+        'zone': get_zone_xy(calibration, lat[0]) # Vertices in metres around lat0, (None, None) without toll zone
+    }
+
+
+# Function to convert integer seconds to times (XX:XX:XX) in one vectorised pass
+def ints_to_time(seconds):
+    seconds = asarray(seconds, dtype=int64)
+    parts = [seconds // 3600, seconds % 3600 // 60, seconds % 60]
+    hours, minutes, secs = (char.zfill(part.astype(str), 2) for part in parts)
+    return char.add(char.add(char.add(char.add(hours, ':'), minutes), ':'), secs)
+
+
+# Function to sample the nodes of a synthetic instance: the depot of the profile and customers scattered around its customers
+# Demand and service time of each customer are those of a random real customer
+def sample_nodes(profile, customers, rng):
+    base = rng.integers(0, len(profile['x'])-1, customers) + 1
+    x = profile['x'][base] + rng.normal(0, profile['jitter'], customers)
+    y = profile['y'][base] + rng.normal(0, profile['jitter'], customers)
+    x = asarray([profile['x'][0], *x])
+    y = asarray([profile['y'][0], *y])
+    demand = rng.integers(0, len(profile['demands_kg']), customers)
+    return DataFrame({
+        'Id': ['D0'] + [f'C{node}' for node in range(1, customers+1)],
+        'Lon': degrees(x / (cos(radians(profile['lat0'])) * earth_radius)),
+        'Lat': degrees(y / earth_radius),
+        'Demand[kg]': [0, *profile['demands_kg'][demand]],
+        'Demand[m^3*10^-3]': [0, *profile['demands_liter'][demand]],
+        'Duration': ints_to_time([0, *profile['service_times'][demand]])
+    })
+
+
+# Function to write the .routes file of sampled nodes block by block (distances rounded to full metres, inside + outside = total)
+def write_routes(path, nodes, profile):
+    ids = nodes['Id'].values
+    lon, lat = nodes['Lon'].values, nodes['Lat'].values
+    x, y = get_local_xy(lon, lat, profile['lat0'])
+    vx, vy = profile['zone']
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for start in range(0, len(ids), routes_block_nodes):
+            block = slice(start, min(start+routes_block_nodes, len(ids)))
+            total, inside, time = (values.astype(int64) for values in estimate_arcs(lon, lat, x, y, block, profile['calibration'], vx, vy))
+            DataFrame({
+                'From': repeat(ids[block], len(ids)),
+                'To': tile(ids, len(ids[block])),
+                'DistanceTotal[km]': total.ravel() / 1000,
+                'DistanceInside[km]': inside.ravel() / 1000,
+                'DistanceOutside[km]': (total-inside).ravel() / 1000,
+                'Duration[s]': ints_to_time(time.ravel())
+            }).to_csv(f, sep=' ', index=False, header=start == 0, float_format='%.3f', lineterminator='\n')
+
+
+# Function to generate a synthetic instance with the given number of customers like a real one and write it to /instances/
+def generate_instance(like, customers, name, seed=None, compile=False):
+    profile = get_profile(like)
+    vx, vy = profile['zone']
+    calibration = profile['calibration']
+    print(f'Profile of {like}: detour {calibration["detour"]:.3f}, {calibration["time_offset"]:.0f}s per arc + {calibration["speed"]*3.6:.1f}km/h, '
+          f'customer spacing {profile["jitter"]:.0f}m, ' + (f'toll zone {abs((vx*roll(vy, -1) - roll(vx, -1)*vy).sum())/2e6:.1f}km²' if vx is not None else 'no toll zone'))
+    nodes = sample_nodes(profile, customers, default_rng(seed))
+    nodes.to_csv(f'./instances/{name}.nodes', sep=' ', index=False, float_format='%.7f', lineterminator='\n')
+    start_time = ti.perf_counter()
+    write_routes(f'./instances/{name}.routes', nodes, profile)
+    print(f'Wrote ./instances/{name}.nodes and ./instances/{name}.routes ({os.path.getsize(f"./instances/{name}.routes")/2**20:.1f}MB) in {ti.perf_counter()-start_time:.1f}s')
+    if compile:
+        start_time = ti.perf_counter()
+        load_instance(name)
+        print(f'Compiled the instance cache in {ti.perf_counter()-start_time:.1f}s')
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic scale-test instance like a real one')
+    parser.add_argument('--like', default='Shanghai', help='real instance whose depot, customer spread, demands, speeds and toll zone are used')
+    parser.add_argument('--customers', type=int, required=True)
+    parser.add_argument('--name', help='name of the new instance (defaults to <like><customers>)')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--compile', action='store_true', help='also build the binary instance cache')
+    parser.add_argument('--force', action='store_true', help='overwrite an existing instance of that name')
+    args = parser.parse_args()
+    name = args.name or f'{args.like}{args.customers}'
+    if os.path.exists(f'./instances/{name}.nodes') and not args.force:
+        parser.error(f'./instances/{name}.nodes exists, use --force to overwrite it')
+    generate_instance(args.like, args.customers, name, args.seed, args.compile)
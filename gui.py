@@ -3,12 +3,21 @@
 """ https://zetcode.com/tkinter/ """
 """ https://www.geeksforgeeks.org/radiobutton-in-tkinter-python/ """
 import time as ti
-from numpy import repeat, arange
+startup_start = ti.perf_counter() # Start of the time to the first window, see window_ready()
+import importlib
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
 import tkinter as tk
 from tkinter import scrolledtext
 from functools import partial
-from utils import count_occurrences, generate_vehicles, write_to_csv, draw_routes
-from route_planning import set_variables, main
+from profiling import record_phase, format_timings
+# utils and route_planning (pandas, OR-Tools, matplotlib) are only imported where needed and preloaded once the window is up,
+# so that the window appears without waiting for them
+
+startup_file = 'output/startup.csv'
 
 # Global variables
 display = 'Welcome to ETS\'s new routing software!\n\nSelect the relevant city, toll, and fleet in the left sidebar.\nChoose your preferred first solution strategy (FSS), local search strategy (LSS), and time limit [sec] via the blue option menus.\nGenerate routes with the green button in the top left!'
@@ -19,10 +28,53 @@ new_toll = 0.00
 existing_fleets = [[19, 0, 0, 0, 0, 0, 0], [8, 12, 0, 0, 0, 0, 0], [0, 17, 0, 0, 0, 0, 0]]
 busy = False
 busy_end = 0
+busy_end_time = 0
+pending = {} # Jobs queued or running in the background worker by job id
+next_job_id = 1
+
+
+# Background worker process: solves queued routing jobs one after another and sends progress and results back to the GUI
+# Setting cancel stops the running search, which then returns the best solution found so far
+def solve_worker(jobs, results, cancel):
+    from route_planning import Scenario # Loaded while the window comes up, in parallel to it
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        cancel.clear()
+        start_time = ti.time()
+        cache_hit = None
+        try:
+            scenario = Scenario(job['vehicles'], job['city'], job['toll'], job['fss'], job['lss'], job['time'])
+            output = scenario.cached_solve(stop_event=cancel, progress=lambda entry: results.put((job['id'], 'progress', entry)))
+            cache_hit = scenario.cache_hit
+        except Exception as e:
+            output = ('', '', '', '', f'Error occurred while solving: {e}', '', f'{e}', False)
+        results.put((job['id'], 'done', (output, round(ti.time()-start_time, 3), cancel.is_set(), cache_hit)))
+
+
+# Function to load the solver modules in the background, so that the first quick plan or result does not wait for them
+def preload():
+    importlib.import_module('route_planning')
+    importlib.import_module('utils')
+
+
+# Function to append the time from start to the first window to the startup file (e.g. to compare packaged builds)
+def write_startup_time(startup_time):
+    try:
+        os.makedirs(os.path.dirname(startup_file), exist_ok=True)
+        new_file = not os.path.exists(startup_file)
+        with open(startup_file, 'a', encoding='utf-8') as f:
+            if new_file:
+                f.write('Date;Frozen;Window [s]\n')
+            f.write(f'{ti.strftime("%Y-%m-%d %H:%M:%S")};{getattr(sys, "frozen", False)};{startup_time:.3f}\n')
+    except OSError as e:
+        print(f'Could not write startup time: {e}')
 
 
 # Main function to create/run GUI
-def gui():
+# With measure_startup the window closes as soon as it is shown, after writing the startup time to the startup file
+def gui(measure_startup=False):
     # Function to increase discrete values for fleet selection
     def int_increase(id):
         value = fleet_nums[id]+1
@@ -62,10 +114,13 @@ def gui():
         global busy_end
         display = texts[radio_top.get()]
         if busy:
-            label_busy.config(text=f'busy until ≤ {busy_end}')
+            queued = f' ({len(pending)-1} queued)' if len(pending) > 1 else ''
+            label_busy.config(text=f'busy until ≤ {busy_end}{queued}')
             label_busy.grid(row=0, column=3, sticky='nsew', padx=5)
+            button_cancel.grid(row=0, column=4, sticky='nsew')
         else:
             label_busy.grid_forget()
+            button_cancel.grid_forget()
         main_pane.configure(state='normal')
         main_pane.delete('1.0', tk.END)
         main_pane.insert(tk.INSERT, display)
@@ -101,43 +156,133 @@ def gui():
                     fleet_labels[id].grid(row=id-1, column=1, sticky='ns')
                     fleet_plus[id].grid(row=id-1, column=2, sticky='ns')
 
-    # Function to call routing script with selected parameters
-    def run_routing():
+    # Function to read the selected parameters as a job for the background worker (None if they are infeasible)
+    def get_job():
         global texts
-        global busy
-        global busy_end
+        global next_job_id
+        from utils import count_occurrences, generate_vehicles
         new_city = 'Paris' if radio.get() == 1 else 'NewYork' if radio.get() == 2 else 'Shanghai'
-        new_vehicles = generate_vehicles(existing_fleets[radio.get()-1]) if radio2.get() == 1 else repeat(arange(1, 8), fleet_nums[0]) if radio2.get() == 2 else generate_vehicles(fleet_nums[1:])
+        new_vehicles = generate_vehicles(existing_fleets[radio.get()-1]) if radio2.get() == 1 else generate_vehicles([fleet_nums[0]]*7) if radio2.get() == 2 else generate_vehicles(fleet_nums[1:])
         new_toll_str = label_value['text']
         new_fss = fss_var.get()
         new_lss = lss_var.get()
         new_time = time_var.get()
-        for id, _ in enumerate(texts):
-            texts[id] += f'### Solving {new_city} with{new_toll_str}tolls and fleet {count_occurrences(new_vehicles)}\n'
+        header = f'### Solving {new_city} with{new_toll_str}tolls and fleet {count_occurrences(new_vehicles)}\n'
+
+        if len(new_vehicles) == 0:
+            texts[0] += header+'Infeasible parameter set detected!\nPlease check your chosen parameters\n\n'
+            texts[1] += header+'No solution possible\n____________________________________________________________\n\n'
+            texts[2] += header+f'Search parameters: FSS={new_fss}, LSS={new_lss}, t={new_time}s\nNo solution possible\n\n'
+            update_display()
+            return None
+
+        job = {'id': next_job_id, 'header': header, 'vehicles': new_vehicles, 'city': new_city, 'toll': new_toll*1000, 'toll_ct': int(new_toll*100), 'fss': new_fss, 'lss': new_lss, 'time': new_time} # Convert toll to 0.1ct value used in router
+        next_job_id += 1
+        return job
+
+    # Function to queue a routing job with selected parameters for the background worker
+    def run_routing():
+        global texts
+        global busy
+        global busy_end
+        global busy_end_time
+        job = get_job()
+        if job is None:
+            return
+        new_time = job['time']
+        header = job['header']
+        pending[job['id']] = job
+        jobs.put(job)
+        texts[2] += f'Queued job #{job["id"]}: {header[4:]}' if busy else ''
         busy = True
-        busy_end = ti.strftime('%X', ti.localtime(ti.time()+new_time))
+        busy_end_time = max(busy_end_time, ti.time()) + new_time
+        busy_end = ti.strftime('%X', ti.localtime(busy_end_time))
         update_display()
 
-        if len(new_vehicles)>0:
-            set_variables(new_vehicles, new_city, new_toll*1000, new_fss, new_lss, new_time) # Convert toll to 0.1ct value used in router
-            start_time = ti.time()
-            routes, load, dist, time, cost, fleet, params, csv_list = main()
-            end_time = ti.time()
-            texts[0] += f'{cost}\n{dist}\n{load}\n{time}\n{fleet}\n\n' if load else f'{cost}\n{dist}\n\n'
-            texts[1] += routes+'\n\n____________________________________________________________\n\n\n\n\n' if load else 'No solution could be found\n____________________________________________________________\n\n'
-            texts[2] += f'{params}\nSearch completed in {round(end_time-start_time, 3)}s\n'
-        else:
-            texts[0] += 'Infeasible parameter set detected!\nPlease check your chosen parameters\n\n'
-            texts[1] += 'No solution possible\n____________________________________________________________\n\n'
-            texts[2] += f'Search parameters: FSS={new_fss}, LSS={new_lss}, t={new_time}s\nNo solution possible\n'
+    # Function to show a quick plan (NumPy savings heuristic, no search) for the selected parameters right away, even while the worker is busy
+    def quick_plan():
+        job = get_job()
+        if job is None:
+            return
+        job['header'] = job['header'].replace('### Solving', '### Quick plan for', 1)
+        job['fss'] = 'NumPy Savings' # The plan is the savings heuristic alone, stored as such rather than under the selected FSS/LSS
+        start_time = ti.time()
+        from route_planning import Scenario
+        try:
+            output = Scenario(job['vehicles'], job['city'], job['toll'], job['fss'], job['lss'], job['time']).solve(quick=True)
+        except Exception as e:
+            output = ('', '', '', '', f'Error occurred while planning: {e}', '', f'{e}', False)
+        job['lss'] = 'None' # No search
+        job['time'] = 0
+        show_result(job, output, round(ti.time()-start_time, 3), False)
         update_display()
+
+    # Function to stop the running search, keeping the best solution found so far (queued jobs still run)
+    def cancel_routing():
+        global texts
+        if busy:
+            cancel.set()
+            texts[2] += 'Cancelling current search...\n'
+            update_display()
+
+    # Function to show the results of a finished job (cache_hit is the run time of the original solve if the result came from the cache)
+    def show_result(job, output, run_time, cancelled, cache_hit=None):
+        global texts
+        routes, load, dist, time, cost, fleet, params, csv_list = output
+        header = job['header']
+        texts[0] += header+(f'{cost}\n{dist}\n{load}\n{time}\n{fleet}\n\n' if load else f'{cost}\n{dist}\n\n')
+        texts[1] += header+(routes+'\n\n____________________________________________________________\n\n\n\n\n' if load else 'No solution could be found\n____________________________________________________________\n\n')
+        texts[2] += header+f'{params}\nSearch {"cancelled" if cancelled else "completed"} in {run_time}s\n'
         if csv_list:
-            texts[2] += write_to_csv(csv_list, new_city, int(new_toll*100), new_time, round(end_time-start_time, 3), routes)
-            draw_routes(csv_list[7], csv_list[8], csv_list[9], csv_list[10], new_city)
+            from result_store import write_result
+            from utils import draw_routes
+            timings = {}
+            phase_start = ti.perf_counter()
+            texts[2] += write_result(csv_list, job['city'], job['toll_ct'], job['fss'], job['lss'], job['time'], run_time if cache_hit is None else cache_hit, job['vehicles'],
+                                     status='Cached' if cache_hit is not None else None)
+            phase_start = record_phase(timings, 'Result write', phase_start)
+            draw_routes(csv_list[7], csv_list[8], csv_list[9], csv_list[10], job['city'])
+            record_phase(timings, 'Plot', phase_start)
+            texts[2] += f'Output phases: {format_timings(timings)}\n'
         texts[2] += '\n'
-        busy = False
-        update_display()
-    
+
+    # Function to fetch results from the background worker without blocking the GUI, re-scheduled every 200ms
+    def poll_results():
+        global texts
+        global busy
+        global busy_end_time
+        changed = False
+        while True:
+            try:
+                job_id, status, payload = results.get_nowait()
+            except queue.Empty:
+                break
+            if status == 'progress':
+                texts[2] += f'  #{job_id} t={payload["Time [s]"]}s: {payload["Cost [€]"]}€ with {payload["Vehicles"]} vehicles ({payload["Solutions"]} solutions)\n'
+            else:
+                show_result(pending.pop(job_id), *payload)
+            changed = True
+        if changed:
+            busy = len(pending) > 0
+            busy_end_time = busy_end_time if busy else 0
+            update_display()
+        window.after(200, poll_results)
+
+    # Function to report the time from start to the first window, then preload the solver modules (or close, if only measuring)
+    def window_ready():
+        startup_time = ti.perf_counter()-startup_start
+        print(f'Window shown {startup_time:.3f}s after start')
+        if measure_startup:
+            write_startup_time(startup_time)
+            close()
+            return
+        threading.Thread(target=preload, daemon=True).start()
+
+    # Function to stop the background worker when the window is closed
+    def close():
+        worker.terminate()
+        window.destroy()
+
 
     # Tkinter window set-up
     window = tk.Tk()
@@ -148,14 +293,16 @@ def gui():
     window.rowconfigure(3, minsize=25, weight=0)
     window.rowconfigure(4, minsize=300, weight=1)
     window.rowconfigure(5, minsize=25, weight=0)
+    window.rowconfigure(6, minsize=25, weight=0)
     window.columnconfigure(0, minsize=120, weight=0)
     window.columnconfigure(1, minsize=600, weight=1)
 
 
     # Content panes set-up
     button_run = tk.Button(window, text='Run routing', background='lime green', activebackground='green')
+    button_quick = tk.Button(window, text='Quick plan', command=quick_plan, background='pale green', activebackground='green')
     top_pane = tk.Frame(window, relief=tk.RAISED, bd=2)
-    fss_options = ['Automatic FSS', 'Path Cheapest Arc', 'Path Most Constrained Arc', 'Evaluator Strategy', 'Savings', 'Sweep', 'Christofides', 'All Unperformed', 'Best Insertion', 'Parallel Cheapest Insertion', 'Local Cheapest Insertion', 'Global Cheapest Arc', 'Local Cheapest Arc', 'First Unbound Min Value']
+    fss_options = ['Automatic FSS', 'Path Cheapest Arc', 'Path Most Constrained Arc', 'Evaluator Strategy', 'Savings', 'Sweep', 'Christofides', 'NumPy Savings', 'All Unperformed', 'Best Insertion', 'Parallel Cheapest Insertion', 'Local Cheapest Insertion', 'Global Cheapest Arc', 'Local Cheapest Arc', 'First Unbound Min Value']
     fss_var = tk.StringVar()
     fss_var.set('Automatic FSS')
     fss_menu = tk.OptionMenu(window, fss_var, *fss_options)
@@ -237,23 +384,38 @@ def gui():
         button.grid(row=0, column=value, sticky='nsew')
         
     label_busy = tk.Label(master=top_pane, text=f'Busy (done by <={busy_end}', fg='red')
+    button_cancel = tk.Button(master=top_pane, text='Cancel', command=cancel_routing, bg='tomato', activebackground='red')
 
 
     # Content pane grid managers
     button_run.configure(command=run_routing)
     button_run.grid(row=0, column=0, sticky='nsew')
+    button_quick.grid(row=6, column=0, sticky='nsew')
     top_pane.grid(row=0, column=1, sticky='nsew')
     fss_menu.grid(row=1, column=0, sticky='nsew')
     lss_menu.grid(row=2, column=0, sticky='nsew')
     time_menu.grid(row=3, column=0, sticky='nsew')
-    main_pane.grid(row=1, rowspan=5, column=1, sticky='nsew')
+    main_pane.grid(row=1, rowspan=6, column=1, sticky='nsew')
     left_pane.grid(row=4, column=0, sticky='nsew')
     button_clear.grid(row=5, column=0, sticky='nsew')
 
     
+    # Background worker process for solving (spawned, so it does not inherit any Tk state)
+    context = mp.get_context('spawn')
+    jobs = context.Queue()
+    results = context.Queue()
+    cancel = context.Event()
+    worker = context.Process(target=solve_worker, args=(jobs, results, cancel), daemon=True)
+    worker.start()
+    window.protocol('WM_DELETE_WINDOW', close)
+    window.after(200, poll_results)
+    window.after_idle(window_ready)
+
+
     # GUI mainloop
     window.mainloop()
 
 
 if __name__ == '__main__':
-    gui()
\ No newline at end of file
+    mp.freeze_support() # Needed for the worker process in the PyInstaller executable
+    gui(measure_startup='--startup-time' in sys.argv) # gui --startup-time only measures the time to the first window
\ No newline at end of file
@@ -21,13 +21,13 @@ a = Analysis(
 )
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
+# Built as a folder (dist/gui/) rather than a single file: a single-file executable unpacks all of NumPy, pandas, OR-Tools
+# and matplotlib to a temporary directory on every start, which dominates the time to the first window
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='gui',
     debug=False,
     bootloader_ignore_signals=False,
@@ -42,3 +42,13 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    name='gui',
+)
@@ -0,0 +1,92 @@
+""" Phase timings and optional profiling of route planning solves """
+""" Every solve records the duration of its phases (instance, data model, checks, model, initial solution, search, solution) in Scenario.timings, """
+""" prints them on the console and adds them to the output CSV. Profiling is switched on by the environment variable ROUTE_PROFILE: """
+"""    ROUTE_PROFILE=cprofile     call statistics of every solve, printed and saved to output/profiles/ (open with pstats or snakeviz) """
+"""    ROUTE_PROFILE=tracemalloc  peak memory of every phase and the largest allocation sites of every solve """
+""" e.g. ROUTE_PROFILE=cprofile,tracemalloc python gui.py (benchmark.py also takes --profile cprofile tracemalloc) """
+import cProfile
+import os
+import pstats
+import threading
+import time as ti
+import tracemalloc
+from functools import wraps
+
+profile_modes = {mode.strip().lower() for mode in os.environ.get('ROUTE_PROFILE', '').split(',') if mode.strip()}
+profile_dir = 'output/profiles'
+profile_lock = threading.Lock() # cProfile and tracemalloc are process-wide, so only one solve at a time is profiled
+
+
+
+# Function to switch profiling on or off from scripts (same modes as ROUTE_PROFILE)
+def set_profile_modes(modes):
+    profile_modes.clear()
+    profile_modes.update(mode.lower() for mode in modes)
+
+
+# Function to record the duration of a phase that started at phase_start (and its peak memory while tracemalloc is tracing)
+# Returns the start of the next phase
+def record_phase(timings, phase, phase_start):
+    now = ti.perf_counter()
+    timings[f'{phase} [s]'] = now-phase_start
+    if tracemalloc.is_tracing():
+        timings[f'{phase} peak [MB]'] = round(tracemalloc.get_traced_memory()[1]/2**20, 3)
+        tracemalloc.reset_peak()
+    return now
+
+
+# Function to format phase timings for the console, e.g. 'Instance 0.012s, Model 0.4s (peak 12.5MB), ...'
+def format_timings(timings):
+    phases = []
+    for key, value in timings.items():
+        if not key.endswith(' [s]') or value is None:
+            continue
+        peak = timings.get(f'{key[:-len(" [s]")]} peak [MB]')
+        phases.append(f'{key[:-len(" [s]")]} {value:.3f}s' + (f' (peak {peak}MB)' if peak is not None else ''))
+    return ', '.join(phases)
+
+
+# Function to print and save the call statistics of a profiled solve
+def report_profile(profiler, name):
+    os.makedirs(profile_dir, exist_ok=True)
+    path = f'{profile_dir}/{name}_{ti.strftime("%Y%m%d-%H%M%S")}_{os.getpid()}.prof'
+    profiler.dump_stats(path)
+    print(f'\nProfile of {name} saved to {path}, top functions by cumulative time:')
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+
+# Function to print the largest allocation sites of a solve traced by tracemalloc
+def report_memory(snapshot, name):
+    current, peak = tracemalloc.get_traced_memory()
+    print(f'\nMemory of {name}: {peak/2**20:.1f}MB peak, {current/2**20:.1f}MB still allocated, largest allocation sites:')
+    for statistic in snapshot.statistics('lineno')[:10]:
+        print(statistic)
+
+
+# Decorator that profiles Scenario solves in the modes of ROUTE_PROFILE (nested or concurrent solves run unprofiled)
+def profiled(solve):
+    @wraps(solve)
+    def profiled_solve(scenario, *args, **kwargs):
+        if not profile_modes or not profile_lock.acquire(blocking=False):
+            return solve(scenario, *args, **kwargs)
+        profiler = cProfile.Profile() if 'cprofile' in profile_modes else None
+        trace_memory = 'tracemalloc' in profile_modes and not tracemalloc.is_tracing()
+        try:
+            if trace_memory:
+                tracemalloc.start(10)
+            if profiler:
+                profiler.enable()
+            try:
+                return solve(scenario, *args, **kwargs)
+            finally:
+                if profiler:
+                    profiler.disable()
+                snapshot = tracemalloc.take_snapshot() if trace_memory else None # Before reporting, so the report's allocations do not show up
+                if profiler:
+                    report_profile(profiler, scenario.city)
+                if trace_memory:
+                    report_memory(snapshot, scenario.city)
+                    tracemalloc.stop()
+        finally:
+            profile_lock.release()
+    return profiled_solve
@@ -0,0 +1,83 @@
+""" Persistent cache of routing results, so identical solve requests return instantly """
+""" Results are stored under a hash of the instance files and all search parameters in output/cache/<key>.pkl """
+""" The cache is size-bounded and evicts the least recently used results first """
+import json
+import os
+import pickle
+from hashlib import sha1
+from utils import get_file_signature
+from estimation import calibration_file
+
+cache_dir = './output/cache'
+max_cache_bytes = 200 * 1024 * 1024
+
+
+# Function to get the files an instance is built from: its .nodes and .routes files, or the estimation calibration if it has no .routes file
+def get_instance_sources(city):
+    routes_path = f'./instances/{city}.routes'
+    return [f'./instances/{city}.nodes', routes_path if os.path.exists(routes_path) else calibration_file]
+
+
+# Function to compute the cache key of a solve request from the content of the instance files and all parameters
+# (stopping rules only count if any is set, so that results cached before they existed stay valid)
+def get_result_key(city, vehicles, toll, fss, lss, timeout, seed, carriers, stop_rules=None):
+    request = {
+        'instance': [get_file_signature(path)['sha1'] for path in get_instance_sources(city)],
+        'city': city,
+        'vehicles': [int(vehicle) for vehicle in vehicles],
+        'toll': toll,
+        'fss': fss,
+        'lss': lss,
+        'timeout': timeout,
+        'seed': seed,
+        'carriers': {key: value for key, value in carriers.items()}
+    }
+    if stop_rules is not None and any(stop_rules.get(rule) is not None for rule in ['stall_time', 'min_improvement', 'target_cost']):
+        request['stop_rules'] = stop_rules
+    return sha1(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Function to load a cached result with the run time [s] of the solve that produced it - returns None if there is none
+# (touching the file marks it as recently used)
+def load_result(key):
+    path = f'{cache_dir}/{key}.pkl'
+    try:
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+        os.utime(path)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    return entry if isinstance(entry, tuple) and len(entry) == 2 else None # Entries cached without their run time are solved again
+
+
+# Function to store a result and the run time [s] of its solve in the cache and evict least recently used results beyond the size limit
+def store_result(key, result, run_time):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(f'{cache_dir}/{key}.pkl.tmp', 'wb') as f:
+            pickle.dump((result, run_time), f)
+        os.replace(f'{cache_dir}/{key}.pkl.tmp', f'{cache_dir}/{key}.pkl')
+        evict_results(max_cache_bytes)
+    except OSError as e:
+        print(f'Could not write result cache: {e}')
+
+
+# Function to delete the least recently used results until the cache is at most max_bytes large
+def evict_results(max_bytes):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl'):
+            try:
+                stat = os.stat(f'{cache_dir}/{name}')
+            except FileNotFoundError:
+                continue # Removed by another process in the meantime
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(f'{cache_dir}/{name}')
+        except FileNotFoundError:
+            pass
+        total -= size
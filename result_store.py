@@ -0,0 +1,186 @@
+""" Store of all routing results in one SQLite database (output/results.sqlite) instead of one CSV file per run """
+""" Every solve from the GUI, route_planning.py, decomposition.py or sweep.py appends one row with its scenario, parameters, metrics, """
+""" phase timings, routes and search trace; nothing is overwritten, so repeated runs of a scenario can be compared """
+""" Query: load_results(sweep='sweep_1a2b3c4d') or load_results(city='Paris', lss='Guided Local Search') returns a DataFrame """
+""" Export: python result_store.py --sweep sweep_1a2b3c4d --csv output/sweep.csv (same filters as load_results, prints a summary without --csv) """
+import argparse
+import json
+import os
+import sqlite3
+import time as ti
+from pandas import concat, read_sql_query
+
+store_file = 'output/results.sqlite'
+json_columns = ['fleet_candidates', 'stop_rules', 'types_seq', 'routes', 'timings', 'trace']
+scenario_columns = ['city', 'toll_ct', 'fss', 'lss', 'timeout', 'seed', 'fleet_candidates', 'stop_rules'] # Rows with equal values are runs of the same scenario
+
+schema = '''
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT NOT NULL,
+    sweep TEXT,
+    scenario_key TEXT,
+    city TEXT NOT NULL,
+    toll_ct INTEGER NOT NULL,
+    fss TEXT NOT NULL,
+    lss TEXT NOT NULL,
+    timeout INTEGER NOT NULL,
+    seed INTEGER,
+    fleet_candidates TEXT,
+    stop_rules TEXT,
+    status TEXT NOT NULL,
+    total_cost REAL,
+    fleet TEXT,
+    vehicles INTEGER,
+    weight_kg REAL,
+    volume_m3 REAL,
+    distance_km REAL,
+    run_time REAL,
+    search_time REAL,
+    stop_reason TEXT,
+    portfolio_winner TEXT,
+    types_seq TEXT,
+    routes TEXT,
+    timings TEXT,
+    trace TEXT
+);
+CREATE INDEX IF NOT EXISTS results_scenario ON results (city, toll_ct, fss, lss, timeout);
+CREATE INDEX IF NOT EXISTS results_sweep ON results (sweep);
+CREATE UNIQUE INDEX IF NOT EXISTS results_sweep_scenario ON results (sweep, scenario_key);
+'''
+
+
+
+# Function to open the results store, creating it on first use (WAL mode, so several processes can write and read at once)
+def open_store(path=store_file):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(schema)
+    return connection
+
+
+# Function to convert NumPy scalars (e.g. in csv_list) to Python values for SQLite and JSON
+def to_python(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+# Function to get the store row of a solve from its csv_list (False if there was no solution, status then says why)
+# vehicles is the candidate fleet of the scenario, stored as number of vehicles per type 1-7
+def get_store_row(csv, city, toll, fss, lss, timeout, run_time, vehicles=None, seed=None, stop_rules=None, status=None, sweep=None, scenario_key=None):
+    def dump(value):
+        return json.dumps(value, default=to_python) if value is not None else None
+
+    row = {
+        'created': ti.strftime('%Y-%m-%d %H:%M:%S'),
+        'sweep': sweep,
+        'scenario_key': scenario_key,
+        'city': city,
+        'toll_ct': int(toll),
+        'fss': fss,
+        'lss': lss,
+        'timeout': int(timeout),
+        'seed': seed,
+        'fleet_candidates': dump([list(vehicles).count(vehicle_type) for vehicle_type in range(1, 8)]) if vehicles is not None else None,
+        'stop_rules': dump(stop_rules),
+        'status': status or ('Solved' if csv else 'No solution'),
+        'run_time': run_time
+    }
+    if csv:
+        row |= {
+            'total_cost': csv[0],
+            'fleet': csv[1],
+            'vehicles': len(csv[8]),
+            'weight_kg': csv[2],
+            'volume_m3': csv[3],
+            'distance_km': csv[4],
+            'search_time': csv[13] if len(csv) > 13 else None,
+            'stop_reason': csv[12] if len(csv) > 13 else None,
+            'portfolio_winner': csv[15] if len(csv) > 15 else None,
+            'types_seq': dump(csv[8]),
+            'routes': dump(csv[9]),
+            'timings': dump(csv[14]) if len(csv) > 14 else None,
+            'trace': dump(csv[11]) if len(csv) > 11 else None
+        }
+    return {key: to_python(value) for key, value in row.items()}
+
+
+# Function to append rows to the store in one transaction - rows of a sweep scenario already stored are skipped
+# Returns the number of rows added
+def append_results(rows, path=store_file):
+    if not rows:
+        return 0
+    connection = open_store(path)
+    try:
+        with connection:
+            added = 0
+            for row in rows:
+                columns = list(row)
+                cursor = connection.execute(f'INSERT OR IGNORE INTO results ({", ".join(columns)}) VALUES ({", ".join("?"*len(columns))})', [row[column] for column in columns])
+                added += cursor.rowcount
+        return added
+    finally:
+        connection.close()
+
+
+# Function to store the result of a single solve (GUI, route_planning.py, decomposition.py) - returns a message for the console
+# Results returned from the result cache are stored with status 'Cached' and the run time of the solve that produced them
+def write_result(csv, city, toll, fss, lss, timeout, run_time, vehicles=None, seed=None, sweep=None, path=store_file, status=None):
+    try:
+        append_results([get_store_row(csv, city, toll, fss, lss, timeout, run_time, vehicles, seed, status=status, sweep=sweep)], path)
+    except (OSError, sqlite3.Error) as e:
+        return f'Error: {e}\n'
+    return f'Output written to {path}\n'
+
+
+# Function to load results from the store as a DataFrame, e.g. all scenarios of a sweep for comparison
+# Filters take a value or a list of values (sweep, city, toll_ct, fss, lss, timeout, status, ...); with latest only the newest run of each scenario
+# is kept, where replays of cached results (status 'Cached') only count for scenarios without any solved run
+# JSON columns (routes, trace, timings, ...) are decoded to Python objects
+def load_results(sweep=None, path=store_file, latest=True, **filters):
+    connection = open_store(path)
+    columns = [column for _, column, *_ in connection.execute('PRAGMA table_info(results)')]
+    filters = {'sweep': sweep, **filters}
+    conditions = []
+    values = []
+    for column, value in filters.items():
+        if value is None:
+            continue
+        if column not in columns:
+            connection.close()
+            raise ValueError(f'Unknown results column {column}')
+        value = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        conditions.append(f'{column} IN ({", ".join("?"*len(value))})')
+        values += value
+    try:
+        results = read_sql_query(f'SELECT * FROM results{" WHERE " + " AND ".join(conditions) if conditions else ""} ORDER BY id', connection, params=values)
+    finally:
+        connection.close()
+    if latest:
+        replayed = results['status'] == 'Cached'
+        results = concat([results[replayed], results[~replayed]]).drop_duplicates(subset=scenario_columns, keep='last').sort_values('id').reset_index(drop=True)
+    for column in json_columns:
+        results[column] = [json.loads(value) if value is not None else None for value in results[column]]
+    return results
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the results store and export results to CSV')
+    parser.add_argument('--sweep')
+    parser.add_argument('--city', nargs='+')
+    parser.add_argument('--toll', dest='toll_ct', nargs='+', type=int, help='tolls in ct/km')
+    parser.add_argument('--fss', nargs='+')
+    parser.add_argument('--lss', nargs='+')
+    parser.add_argument('--timeout', nargs='+', type=int)
+    parser.add_argument('--all-runs', action='store_true', help='keep every run of a scenario, not only the newest')
+    parser.add_argument('--csv', help='export the results to this CSV file')
+    parser.add_argument('--store', default=store_file)
+    args = parser.parse_args()
+
+    results = load_results(args.sweep, args.store, not args.all_runs, city=args.city, toll_ct=args.toll_ct, fss=args.fss, lss=args.lss, timeout=args.timeout)
+    if args.csv:
+        results.to_csv(args.csv, index=False, sep=';')
+        print(f'{len(results.index)} results written to {args.csv}')
+    else:
+        print(results[['id', 'created', 'sweep', 'city', 'toll_ct', 'fss', 'lss', 'timeout', 'status', 'total_cost', 'vehicles', 'run_time']].to_string(index=False))
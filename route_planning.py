@@ -2,85 +2,299 @@
 """ Please find the original code here: https://developers.google.com/optimization/routing/cvrp#entire_program """
 """ Distances [m], weight [g], volume [l], and cost [0.1ct] to keep precision reasonably high, as the solver only accepts integer values """
 from ortools.constraint_solver import routing_parameters_pb2
-from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
-from numpy import repeat, arange
+from numpy import repeat, arange, rint, int64, asarray, array, flatnonzero, logical_or, stack, where, iinfo, fill_diagonal
+import os
 import time as ti
-from utils import get_nodes, get_routes, get_distance_matrix_from_routes, get_time_matrix_from_routes, get_time_list_from_nodes, count_occurrences, int_to_time, get_fss, get_lss, check_infeasibility, write_to_csv
-
-# Global variable defaults - Values are adjusted from GUI through set_variables()
-vehicles = repeat(arange(1, 8), 20)
-num_vehicles = len(vehicles)
-city = 'Shanghai'
-toll = 200
-timeout = 10800
-fss = routing_enums_pb2.FirstSolutionStrategy.AUTOMATIC
-fss_string = 'Automatic'
-lss = routing_enums_pb2.LocalSearchMetaheuristic.AUTOMATIC
-lss_string = 'Automatic'
-city_int = 0 if city=='Paris' else 1 if city=='NewYork' else 2
-
-# Carrier characteristics
+import multiprocessing as mp
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from result_cache import get_result_key, load_result, store_result
+from profiling import profiled, record_phase, format_timings
+from utils import load_instance, get_nodes_from_instance, count_occurrences, int_to_time, get_fss, get_lss, check_infeasibility, check_node_infeasibility, get_depot_round_trips
+from result_store import write_result
+from estimation import estimate_instance
+
+# Carrier characteristics (cost per km inside/outside the toll zone depends on a scenario's city and toll, see get_carriers())
 carriers = {}
 carriers['ids'] = [1, 2, 3, 4, 5, 6, 7]
 carriers['payloads'] = [2800000, 883000, 670000, 2800000, 905000, 720000, 100000] # in g
 carriers['volumes'] = [34800, 5800, 3200, 21560, 7670, 4270, 200] # in liters
 carriers['ranges'] = [1028571, 875000, 847458, 79710, 205023, 118977, 100000] # in m
 carriers['cpkm_cities'] = [[2396, 2155, 2082, 2475, 2161, 2105, 3560], [3181, 3017, 2961, 3377, 3082, 3027, 3700], [1070, 892, 833, 1233, 944, 889, 1810]]
-carriers['cpkm_outside'] = carriers['cpkm_cities'][city_int]
-carriers['cpkm_inside'] = [c+toll if num<3 else c for num, c in enumerate(carriers['cpkm_outside'])]
 
+# Route limits applying to all vehicles
+max_route_time = 28800 # 28800s = 8h is maximum time allowed for a route
+max_route_cost = 1000000 # in 0.1ct
 
+# Stopping rules ending a search before its time limit (None disables a rule): after stall_time seconds without improvement,
+# once the cost improved by less than min_improvement (relative, e.g. 0.001) over the last window seconds, or at target_cost [€]
+default_stop_rules = {'stall_time': None, 'min_improvement': None, 'window': 60, 'target_cost': None}
 
-# Set search parameters from outside
-def set_variables(new_vehicles, new_city, new_toll, new_fss, new_lss, new_time):
-    global vehicles, num_vehicles, city, city_int, toll, carriers, timeout, fss_string, lss_string, fss, lss
-    vehicles = new_vehicles
-    num_vehicles = len(vehicles)
-    city = new_city
-    city_int = 0 if city=='Paris' else 1 if city=='NewYork' else 2
-    toll = new_toll
-    carriers['cpkm_outside'] = carriers['cpkm_cities'][city_int]
-    carriers['cpkm_inside'] = [c+toll if num<3 else c for num, c in enumerate(carriers['cpkm_outside'])]
-    timeout = new_time
-    fss_string = new_fss
-    lss_string = new_lss
-    fss = get_fss(new_fss)
-    lss = get_lss(new_lss)
+# Instances loaded so far in this process, shared read-only by all scenarios
+shared_instances = {}
+shared_instances_lock = threading.Lock()
 
 
 
-# Create data model for problem
-def create_data_model():
-    nodes = get_nodes(city)
-    num_nodes = len(nodes.index)
-    routes = get_routes(city)
-
-    data = {}
-    data['city'] = city
-    data['nodes'] = nodes
-    data['distance_total'] = get_distance_matrix_from_routes(routes, num_nodes, 'Total')
-    data['distance_inside'] = get_distance_matrix_from_routes(routes, num_nodes, 'Inside')
-    data['distance_outside'] = get_distance_matrix_from_routes(routes, num_nodes, 'Outside')
-    data['time_routes'] = get_time_matrix_from_routes(routes, num_nodes)
-    data['time_nodes'] = get_time_list_from_nodes(nodes)
-    data['demands_g'] = [d*1000 for d in nodes['Demand[kg]'].values]
-    data['demands_liter'] = nodes['Demand[m^3*10^-3]'].values
-    data['vehicles'] = vehicles
-    data['vehicle_payloads'] = [carriers['payloads'][i-1] for i in vehicles]
-    data['vehicle_volumes'] = [carriers['volumes'][i-1] for i in vehicles]
-    data['ranges'] = [carriers['ranges'][i-1] for i in vehicles]
-    data['num_vehicles'] = num_vehicles
-    data['depot'] = 0
-    data['fss'] = fss
-    data['lss'] = lss
-    return data
+# Get the (memory-mapped, read-only) instance of a city, loading it only once per process
+def get_shared_instance(city):
+    with shared_instances_lock:
+        if city not in shared_instances:
+            if os.path.exists(f'./instances/{city}.routes'):
+                shared_instances[city] = load_instance(city) # Memory-mapped from /instances/.cache/ unless the .nodes/.routes files changed
+            else:
+                shared_instances[city] = estimate_instance(city) # New order sets: matrices estimated from the coordinates of the .nodes file
+        return shared_instances[city]
+
+
+
+# Carrier table of a scenario, with cost per km outside the toll zone of its city and inside it (plus toll for types 1-3)
+def get_carriers(city, toll):
+    city_int = 0 if city=='Paris' else 1 if city=='NewYork' else 2
+    scenario_carriers = dict(carriers)
+    scenario_carriers['cpkm_outside'] = carriers['cpkm_cities'][city_int]
+    scenario_carriers['cpkm_inside'] = [c+toll if num<3 else c for num, c in enumerate(scenario_carriers['cpkm_outside'])]
+    return scenario_carriers
+
+
+
+# Arc costs [0.1ct] of a carrier type between all nodes, rounded like the solver's integer costs
+def get_cost_matrix(data, carrier_id):
+    cost = data['distance_inside'] / 1000 * data['carriers']['cpkm_inside'][carrier_id] + data['distance_outside'] / 1000 * data['carriers']['cpkm_outside'][carrier_id]
+    return rint(cost).astype(int64)
+
+
+
+# Largest amount by which going from one node directly to another is longer than going there via the depot (0 if never)
+def get_depot_slack(matrix):
+    matrix = asarray(matrix, dtype=int64)
+    return max(int((matrix - matrix[:, 0, None] - matrix[None, 0, :]).max()), 0)
+
+
+
+# Bounds on the number of vehicles of each type of the fleet an optimal solution needs, as {type: (lower, upper)}
+# A type can serve a customer if the shortest possible trip depot -> customer -> depot fits all its limits
+# Lower: the customers only this type can serve have to fit into its vehicles by weight and volume
+# Upper: at most the available vehicles of the type and one per customer it can serve
+# If the type's cost matrix satisfies the triangle inequality via the depot (cost slack 0), two of its routes that together fit its
+# limits can be merged into one that is no more expensive, as going from the last customer of one route to the first of the other is
+# at most the slack longer than returning to the depot in between; an optimal solution then needs at most one route of the type that
+# fills at most half of each of its limits, plus the routes that fill more than half of one limit - whose totals are at most those of
+# serving every servable customer on its own trip. With a positive cost slack a merged route can cost more, so this bound is not used
+def get_fleet_bounds(data, vehicles):
+    customers = arange(len(data['distance_total'])) != data['depot']
+    distance, time = data['distance_total'], data['time_routes'] + data['time_nodes'][None, :]
+    shortest_distance, shortest_time = get_depot_round_trips(distance), get_depot_round_trips(time)
+    slack_distance, slack_time = get_depot_slack(distance), get_depot_slack(data['time_routes'])
+    fleet_types = sorted({int(vehicle_type) for vehicle_type in vehicles})
+
+    servable = {}
+    totals = {}
+    for vehicle_type in fleet_types:
+        carrier_id = vehicle_type-1
+        cost = data['cost_matrices'][vehicle_type]
+        slack_cost = get_depot_slack(cost)
+        servable[vehicle_type] = (customers & (data['demands_g'] <= data['carriers']['payloads'][carrier_id])
+            & (data['demands_liter'] <= data['carriers']['volumes'][carrier_id])
+            & (shortest_distance <= data['carriers']['ranges'][carrier_id])
+            & (shortest_time <= max_route_time)
+            & (get_depot_round_trips(cost) <= max_route_cost))
+        # (total, limit, slack) of each limit over all servable customers, each served on its own trip
+        nodes = flatnonzero(servable[vehicle_type])
+        totals[vehicle_type] = [
+            (data['demands_g'][nodes].sum(), data['carriers']['payloads'][carrier_id], 0),
+            (data['demands_liter'][nodes].sum(), data['carriers']['volumes'][carrier_id], 0),
+            ((distance[0, nodes] + distance[nodes, 0]).sum() + len(nodes)*slack_distance, data['carriers']['ranges'][carrier_id], slack_distance),
+            ((time[0, nodes] + time[nodes, 0]).sum() + len(nodes)*slack_time, max_route_time, slack_time),
+            ((cost[0, nodes] + cost[nodes, 0]).sum() + len(nodes)*slack_cost, max_route_cost, slack_cost)]
+
+    available = count_occurrences(vehicles)
+    bounds = {}
+    for vehicle_type in fleet_types:
+        carrier_id = vehicle_type-1
+        only = servable[vehicle_type] & ~logical_or.reduce([servable[other] for other in fleet_types if other != vehicle_type] + [~customers])
+        lower = max(ceil(data['demands_g'][only].sum() / data['carriers']['payloads'][carrier_id]), ceil(data['demands_liter'][only].sum() / data['carriers']['volumes'][carrier_id]))
+        upper = min(available[vehicle_type], int(servable[vehicle_type].sum()))
+        if totals[vehicle_type][-1][2] == 0 and all(limit > slack for _, limit, slack in totals[vehicle_type]):
+            upper = min(upper, 1 + sum(int(2*total // (limit-slack)) for total, limit, slack in totals[vehicle_type]))
+        bounds[vehicle_type] = (lower, upper)
+    return bounds
+
+
+
+# Removes the vehicles of each type beyond its upper bound, keeping the order of the fleet
+def prune_fleet(vehicles, bounds):
+    kept = {vehicle_type: 0 for vehicle_type in bounds}
+    pruned = []
+    for vehicle_type in vehicles:
+        if kept[vehicle_type] < bounds[vehicle_type][1]:
+            kept[vehicle_type] += 1
+            pruned.append(vehicle_type)
+    return pruned
+
+
+
+# Checks whether a route (customer nodes without depot) satisfies all limits of a vehicle type
+def route_is_feasible(data, route, vehicle_type):
+    path = [data['depot']] + list(route) + [data['depot']]
+    carrier_id = vehicle_type-1
+    return (data['demands_g'][route].sum() <= data['carriers']['payloads'][carrier_id]
+        and data['demands_liter'][route].sum() <= data['carriers']['volumes'][carrier_id]
+        and data['distance_total'][path[:-1], path[1:]].sum() <= data['carriers']['ranges'][carrier_id]
+        and data['time_routes'][path[:-1], path[1:]].sum() + data['time_nodes'][path[1:]].sum() <= max_route_time
+        and data['cost_matrices'][vehicle_type][path[:-1], path[1:]].sum() <= max_route_cost)
+
+
+
+# Repairs the routes of a previous solution (lists of nodes incl. depot, optionally with their vehicle types as in csv_list)
+# into one route per vehicle of the current fleet, to be used as initial solution of the search:
+# routes are split where they break a limit of their vehicle type, moved to another type if their type ran out,
+# and customers left over or new in the instance are inserted where they add the least cost
+# Returns None if no feasible assignment could be built
+def repair_routes(data, routes, types=None):
+    depot = data['depot']
+    num_nodes = len(data['distance_total'])
+    fleet_types = list(data['cost_matrices'])
+    seen = {depot}
+
+    # Split routes into pieces that fit their vehicle type (or any type of the fleet if the type is unknown)
+    pieces = []
+    for route_id, route in enumerate(routes):
+        preferred = types[route_id] if types is not None and route_id < len(types) and types[route_id] in fleet_types else None
+        candidates = [preferred] if preferred is not None else fleet_types
+        piece = []
+        for node in route:
+            node = int(node)
+            if node in seen or node >= num_nodes:
+                continue
+            seen.add(node)
+            if piece and not any(route_is_feasible(data, piece+[node], vehicle_type) for vehicle_type in candidates):
+                pieces.append((preferred, piece))
+                piece = []
+            piece.append(node)
+        if piece:
+            pieces.append((preferred, piece))
+
+    # Assign pieces to free vehicles, preferring the previous type and otherwise the cheapest feasible one
+    free = {vehicle_type: [vehicle_id for vehicle_id, vt in enumerate(data['vehicles']) if vt == vehicle_type] for vehicle_type in fleet_types}
+    vehicle_routes = [[] for _ in range(data['num_vehicles'])]
+    unassigned = []
+    for preferred, piece in pieces:
+        path = [depot] + piece + [depot]
+        options = sorted(fleet_types, key=lambda vehicle_type: (vehicle_type != preferred, data['cost_matrices'][vehicle_type][path[:-1], path[1:]].sum()))
+        vehicle_type = next((vehicle_type for vehicle_type in options if free[vehicle_type] and route_is_feasible(data, piece, vehicle_type)), None)
+        if vehicle_type is None:
+            unassigned += piece
+        else:
+            vehicle_routes[free[vehicle_type].pop(0)] = piece
+    unassigned += [node for node in range(num_nodes) if node not in seen]
+
+    # Cheapest feasible insertion of all remaining customers, either into a used vehicle or as new route of a free vehicle
+    for node in unassigned:
+        best = None
+        for vehicle_id, route in enumerate(vehicle_routes):
+            vehicle_type = data['vehicles'][vehicle_id]
+            if not route and free[vehicle_type][:1] != [vehicle_id]:
+                continue # Only try the first free vehicle of each type
+            path = [depot] + route + [depot]
+            cost = data['cost_matrices'][vehicle_type]
+            deltas = cost[path[:-1], node] + cost[node, path[1:]] - cost[path[:-1], path[1:]]
+            for position in deltas.argsort():
+                if best is not None and deltas[position] >= best[0]:
+                    break
+                candidate = route[:position] + [node] + route[position:]
+                if route_is_feasible(data, candidate, vehicle_type):
+                    best = (deltas[position], vehicle_id, candidate)
+                    break
+        if best is None:
+            return None
+        if not vehicle_routes[best[1]]:
+            free[data['vehicles'][best[1]]].pop(0)
+        vehicle_routes[best[1]] = best[2]
+
+    print(f'Warm start from {len(routes)} routes: {len(pieces)} route pieces, {len(unassigned)} customers re-inserted')
+    return vehicle_routes
+
+
+
+# Builds a route plan with the savings heuristic of Clarke and Wright, adapted to the heterogeneous fleet: every customer starts on
+# its own route with the cheapest vehicle type that fits, and routes are joined end-to-start in order of decreasing distance savings
+# as long as the joined route fits a vehicle type and is not more expensive than both routes were
+# Route totals are kept as NumPy arrays over all types of the fleet, so every join is checked in a few vector operations
+# Returns routes (lists of nodes incl. depot, like csv_list[9]) and their vehicle types (None where none of that type was left)
+def get_savings_routes(data):
+    depot = data['depot']
+    num_nodes = len(data['distance_total'])
+    fleet_types = list(data['cost_matrices'])
+    carrier_ids = [vehicle_type-1 for vehicle_type in fleet_types]
+    payloads = array([data['carriers']['payloads'][i] for i in carrier_ids])
+    volumes = array([data['carriers']['volumes'][i] for i in carrier_ids])
+    ranges = array([data['carriers']['ranges'][i] for i in carrier_ids])
+    distance = asarray(data['distance_total'], dtype=int64)
+    time = asarray(data['time_routes'], dtype=int64) + asarray(data['time_nodes'], dtype=int64)[None, :]
+    cost = stack([data['cost_matrices'][vehicle_type] for vehicle_type in fleet_types])
+
+    def cheapest(weight, volume, route_distance, route_time, route_cost):
+        fits = (weight <= payloads) & (volume <= volumes) & (route_distance <= ranges) & (route_time <= max_route_time) & (route_cost <= max_route_cost)
+        return where(fits, route_cost, iinfo(int64).max).min(), fits
+
+    # One route per customer (route ids are the customers' node numbers)
+    routes = {node: [node] for node in range(num_nodes) if node != depot}
+    route_of = list(range(num_nodes))
+    weights = asarray(data['demands_g'], dtype=int64).copy()
+    volumes_used = asarray(data['demands_liter'], dtype=int64).copy()
+    distances = distance[depot, :] + distance[:, depot]
+    times = time[depot, :] + time[:, depot]
+    costs = cost[:, depot, :] + cost[:, :, depot]
+    best = array([cheapest(weights[node], volumes_used[node], distances[node], times[node], costs[:, node])[0] for node in range(num_nodes)])
+
+    # Savings of driving from i directly to j instead of via the depot, only for pairs that save distance
+    savings = distance[:, depot, None] + distance[None, depot, :] - distance
+    savings[depot, :] = 0
+    savings[:, depot] = 0
+    fill_diagonal(savings, 0)
+    candidates = flatnonzero(savings > 0)
+    for i, j in zip(*divmod(candidates[savings.ravel()[candidates].argsort(kind='stable')[::-1]], num_nodes)):
+        first, second = route_of[i], route_of[j]
+        if first == second or routes[first][-1] != i or routes[second][0] != j:
+            continue
+        joined_cost, _ = cheapest(weights[first] + weights[second], volumes_used[first] + volumes_used[second],
+                                  distances[first] + distances[second] - distance[i, depot] - distance[depot, j] + distance[i, j],
+                                  times[first] + times[second] - time[i, depot] - time[depot, j] + time[i, j],
+                                  costs[:, first] + costs[:, second] - cost[:, i, depot] - cost[:, depot, j] + cost[:, i, j])
+        if joined_cost > best[first] + best[second]:
+            continue
+        weights[first] += weights[second]
+        volumes_used[first] += volumes_used[second]
+        distances[first] += distances[second] - distance[i, depot] - distance[depot, j] + distance[i, j]
+        times[first] += times[second] - time[i, depot] - time[depot, j] + time[i, j]
+        costs[:, first] += costs[:, second] - cost[:, i, depot] - cost[:, depot, j] + cost[:, i, j]
+        best[first] = joined_cost
+        for node in routes[second]:
+            route_of[node] = first
+        routes[first] += routes.pop(second)
+
+    # Assign vehicle types, routes with the fewest fitting types first, each to the cheapest fitting type with vehicles left
+    available = count_occurrences(data['vehicles'])
+    options = {route_id: cheapest(weights[route_id], volumes_used[route_id], distances[route_id], times[route_id], costs[:, route_id])[1] for route_id in routes}
+    plan = []
+    for route_id in sorted(routes, key=lambda route_id: (options[route_id].sum(), -best[route_id])):
+        fitting = [k for k in costs[:, route_id].argsort() if options[route_id][k] and available.get(fleet_types[k], 0) > 0]
+        vehicle_type = fleet_types[fitting[0]] if fitting else None
+        if vehicle_type is not None:
+            available[vehicle_type] -= 1
+        plan.append(([depot] + routes[route_id] + [depot], vehicle_type))
+    return [route for route, _ in plan], [vehicle_type for _, vehicle_type in plan]
 
 
 
 # Prints solution on console/GUI
 def print_solution(data, manager, routing, solution):
-    toll_str = '{:.2f}'.format(toll/1000)
+    vehicles = data['vehicles']
+    carriers = data['carriers']
+    toll_str = '{:.2f}'.format(data['toll']/1000)
     all_routes_string = ''
     total_cost = 0
     total_distance = 0
@@ -113,11 +327,12 @@ def print_solution(data, manager, routing, solution):
             subroute.append(node_index)
             previous_index = index
             index = solution.Value(routing.NextVar(index))
+            next_node_index = manager.IndexToNode(index)
             route_cost += routing.GetArcCostForVehicle(previous_index, index, vehicle_id)
-            route_distance += data['distance_total'][node_index][manager.IndexToNode(index)]
-            route_distance_inside += data['distance_inside'][node_index][manager.IndexToNode(index)]
-            route_distance_outside += data['distance_outside'][node_index][manager.IndexToNode(index)]
-            route_time += data['time_routes'][node_index][manager.IndexToNode(index)] + data['time_nodes'][manager.IndexToNode(index)]
+            route_distance += data['distance_total'][node_index, next_node_index]
+            route_distance_inside += data['distance_inside'][node_index, next_node_index]
+            route_distance_outside += data['distance_outside'][node_index, next_node_index]
+            route_time += data['time_routes'][node_index, next_node_index] + data['time_nodes'][next_node_index]
 
         route_string += f'[{manager.IndexToNode(index)}] ({route_payload/1000}kg; {route_volume/1000}m3)\n'
         subroute.append(manager.IndexToNode(index))
@@ -148,136 +363,387 @@ def print_solution(data, manager, routing, solution):
     total_dist_string = f'Total distance of all routes: {total_distance/1000}km'
     total_time_string = f'Total time of all routes: {int_to_time(total_time)}'
     chosen_fleet_string = f'Chosen fleet: {count_occurrences(chosen_fleet)} ({len(chosen_fleet)} vehicles)'
-    chosen_parameter_string = f'Solution for {city} with {toll_str}€/km tolls and fleet {count_occurrences(vehicles)}\nSearch parameters: FSS={fss_string}, LSS={lss_string}, t={timeout}s'
+    pruned_string = f' (pruned to {count_occurrences(vehicles)})' if len(vehicles) < len(data['candidate_vehicles']) else ''
+    chosen_parameter_string = f'Solution for {data["city"]} with {toll_str}€/km tolls and fleet {count_occurrences(data["candidate_vehicles"])}{pruned_string}\nSearch parameters: FSS={data["fss_string"]}, LSS={data["lss_string"]}, t={data["timeout"]}s\nSearch ended after {data["stop_time"]}s: {data["stop_reason"]}'
     print(f'{all_routes_string}\n{total_dist_string}\n{total_cost_string}\n{total_load_string}\n{chosen_fleet_string}')
     print(f'Types: {types}')
     print(f'Types_seq: {types_seq}')
     print(f'Routes: {routes}')
-    return all_routes_string, total_load_string, total_dist_string, total_time_string, total_cost_string, chosen_fleet_string, chosen_parameter_string, [total_cost/1000, f'{count_occurrences(chosen_fleet)}', total_payload/1000, total_volume/1000, total_distance/1000, fss, lss, types, types_seq, routes, data['nodes']]
-
-
-
-# Solve the CVRP problem
-def main():
-    # Instantiate the data problem
-    data = create_data_model()
-
-    # Check if provided vehicles have enough weight/volume to cover capacity (in theory)
-    impossible, out_string = check_infeasibility(data['vehicle_payloads'], data['vehicle_volumes'], data['demands_g'], data['demands_liter'])
-    if impossible:
-        return out_string
-
-    # Create the routing index manager
-    manager = pywrapcp.RoutingIndexManager(len(data['distance_total']),
-                                           data['num_vehicles'], data['depot'])
-
-    # Create Routing Model
-    routing = pywrapcp.RoutingModel(manager)
-
-    def distance_callback(from_index, to_index):
-        # Returns the distance between the two nodes
-        # Convert from routing variable Index to distance matrix NodeIndex
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_total'][from_node][to_node]
-
-    distance_callback_index = routing.RegisterTransitCallback(distance_callback)
-    routing.AddDimensionWithVehicleCapacity(distance_callback_index, 0, data['ranges'], True, 'Range')
-
-    # Create and register a transit callback
-    def cost_callback(vehicle_id):
-        def dist_callback(from_index, to_index):
-            # Returns the distance between the two nodes
-            # Convert from routing variable Index to distance matrix NodeIndex
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return round(data['distance_inside'][from_node][to_node] / 1000 * carriers['cpkm_inside'][vehicle_id] + data['distance_outside'][from_node][to_node] / 1000 * carriers['cpkm_outside'][vehicle_id])
-        return dist_callback
-
-    # Define arc costs of each vehicle
-    cost_callbacks = []
-    for vehicle_id, vehicle_type in enumerate(vehicles):
-        cost_callbacks.append(routing.RegisterTransitCallback(cost_callback(vehicle_type-1)))
-        routing.SetArcCostEvaluatorOfVehicle(cost_callbacks[-1], vehicle_id)
-
-    # Add Cost constraints
-    routing.AddDimensionWithVehicleTransits(cost_callbacks, 0, 1000000, True, 'Cost')
-    cost_dimension = routing.GetDimensionOrDie('Cost')
-    cost_dimension.SetGlobalSpanCostCoefficient(0) # Sets Global Span Coefficient to Zero - GSC would add costs for difference between longest and shortest route -> Forcing routes of similar length
-
-    # Add Capacity (Weight) constraint
-    def payload_callback(from_index):
-        # Returns the weight demand of the node
-        # Convert from routing variable Index to demands NodeIndex
-        from_node = manager.IndexToNode(from_index)
-        return data['demands_g'][from_node]
-
-    payload_callback_index = routing.RegisterUnaryTransitCallback(payload_callback)
-    routing.AddDimensionWithVehicleCapacity(payload_callback_index, 0,  data['vehicle_payloads'], True, 'Payload')
-
-    # Add Capacity (Volume) constraint.
-    def volume_callback(from_index):
-        #Returns the volume demand of the node.
-        # Convert from routing variable Index to demands NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        return data['demands_liter'][from_node]
-
-    volume_callback_index = routing.RegisterUnaryTransitCallback(volume_callback)
-    routing.AddDimensionWithVehicleCapacity(volume_callback_index, 0, data['vehicle_volumes'], True, 'Volume')
-
-    # Add Time dimension.
-    def time_callback(from_index, to_index):
-        # Returns the time  between the two nodes
-        # Convert from routing variable Index to distance matrix NodeIndex
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['time_routes'][from_node][to_node] + data['time_nodes'][to_node]
-
-    time_callback_index = routing.RegisterTransitCallback(time_callback)
-    routing.AddDimension(time_callback_index, 0, 28800, True, 'Time') # 28800s = 8h is maximum time allowed for a route 
-
-    # Setting solver parameters
-    try:
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    except Exception as e:
-        print('Error occured: ', e)
-        input('Press any key to exit.')
-        return '', '', '', '', f'Error occurred while solving: {e}', '', f'{e}', False
-    search_parameters.first_solution_strategy = fss
-    search_parameters.local_search_metaheuristic = lss
-    search_parameters.time_limit.FromSeconds(timeout)
-
-    # Solve the problem
-    try:
-        busy_end = ti.strftime('%X', ti.localtime(ti.time()+timeout))
-        print(f'\nSearching {city} with fleet {count_occurrences(vehicles)}')
-        print(f'ending by latest: {busy_end}')
-        # print(search_parameters)
-        solution = routing.SolveWithParameters(search_parameters)
-    except Exception as e:
-        return '', '', '', '', f'Error occurred while solving: {e}', '', f'{e}', False
-
-
-    # Print solution on console
-    if solution:
-        return print_solution(data, manager, routing, solution)
-    else:
-        return 'No solution could be found!', '', 'Please check your chosen parameters for feasibility.', '', 'No solution could be found!', '', 'No solution could be found', False
+    return all_routes_string, total_load_string, total_dist_string, total_time_string, total_cost_string, chosen_fleet_string, chosen_parameter_string, [total_cost/1000, f'{count_occurrences(chosen_fleet)}', total_payload/1000, total_volume/1000, total_distance/1000, data['fss'], data['lss'], types, types_seq, routes, data['nodes'], data['trace'], data['stop_reason'], data['stop_time']]
+
+
+
+# Reason to end a search early by the stopping rules (see default_stop_rules), given its trace and the seconds searched so far
+# Returns None as long as the search should go on (checked after every solution the search accepts, see get_trace_callback())
+def get_stop_reason(rules, trace, elapsed):
+    if not trace:
+        return None
+    best = trace[-1]
+    if rules['target_cost'] is not None and best['Cost [€]'] <= rules['target_cost']:
+        return f'Target cost of {rules["target_cost"]}€ reached'
+    if rules['stall_time'] is not None and elapsed - best['Time [s]'] >= rules['stall_time']:
+        return f'No improvement for {rules["stall_time"]}s'
+    if rules['min_improvement'] is not None and elapsed >= rules['window']:
+        before = [entry for entry in trace if entry['Time [s]'] <= elapsed - rules['window']]
+        if before and before[-1]['Cost [€]'] - best['Cost [€]'] < rules['min_improvement'] * before[-1]['Cost [€]']:
+            return f'Less than {rules["min_improvement"]:.2%} improvement in {rules["window"]}s'
+    return None
+
+
+
+# Search progress callback: records time, cost, vehicles used and number of solutions whenever the search improves
+# The trace entries are appended to trace and, if given, passed on to progress (e.g. for live display in the GUI)
+# After every solution check() is asked for a reason to stop (kept in reason[0]), which finishes the search with the best solution so far
+# (checking here rather than in a search limit keeps Python out of the solver's inner loop, limits are checked far more often)
+def get_trace_callback(routing, trace, start_time, progress=None, check=None, reason=None):
+    solutions = [0]
+    best = [None]
+    def at_solution():
+        solutions[0] += 1
+        cost = routing.CostVar().Max()
+        if best[0] is None or cost < best[0]:
+            best[0] = cost
+            used = sum(not routing.IsEnd(routing.NextVar(routing.Start(vehicle_id)).Value()) for vehicle_id in range(routing.vehicles()))
+            trace.append({'Time [s]': round(ti.time()-start_time, 3), 'Cost [€]': cost/1000, 'Vehicles': used, 'Solutions': solutions[0]})
+            if progress is not None:
+                progress(trace[-1])
+        if check is not None:
+            reason[0] = check()
+            if reason[0] is not None:
+                routing.solver().FinishCurrentSearch()
+    return at_solution
+
+
+
+# Strategy combinations (FSS, LSS, seed) raced against each other by solve_portfolio()
+portfolio = [
+    ('Path Cheapest Arc', 'Guided Local Search', 0),
+    ('Savings', 'Guided Local Search', 0),
+    ('Parallel Cheapest Insertion', 'Guided Local Search', 0),
+    ('Christofides', 'Guided Local Search', 0),
+    ('Path Cheapest Arc', 'Simulated Annealing', 1),
+    ('Savings', 'Simulated Annealing', 2),
+    ('Path Cheapest Arc', 'Tabu Search', 0),
+    ('Local Cheapest Insertion', 'Generic Tabu Search', 0)
+]
+
+
+# Solves a scenario with one portfolio member - runs in a worker process
+# arguments are those of the raced scenario (incl. instance, carriers, prune and stop rules), the member sets its FSS, LSS and seed
+def solve_portfolio_member(arguments, member, member_timeout):
+    return Scenario(**arguments, fss=member[0], lss=member[1], timeout=member_timeout, seed=member[2]).solve()
+
+
+
+# A self-contained routing scenario that owns its fleet, city, toll, carrier table and search parameters
+# Scenarios share no mutable state (instances are shared read-only), so several can be solved at once in different threads
+class Scenario:
+    def __init__(self, vehicles, city, toll, fss, lss, timeout, seed=None, instance=None, prune=True, stop_rules=None, carriers=None):
+        self.vehicles = vehicles
+        self.num_vehicles = len(vehicles)
+        self.city = city
+        self.toll = toll
+        self.carriers = carriers or get_carriers(city, toll) # Carrier table of the city unless given (e.g. for benchmark instances, see cvrplib.py)
+        self.timeout = timeout
+        self.fss_string = fss
+        self.lss_string = lss
+        self.fss = get_fss(fss)
+        self.lss = get_lss(lss)
+        self.seed = seed
+        self.instance = instance # Loaded instance to use, defaults to the one shared by all scenarios of the city
+        self.prune = prune # Remove vehicles an optimal solution cannot need before building the routing model, see get_fleet_bounds()
+        self.stop_rules = default_stop_rules | (stop_rules or {}) # End the search early once it converged, see get_stop_reason()
+        self.timings = {} # Durations of the phases of the last solve
+        self.cache_hit = None # Run time [s] of the original solve if the last cached_solve() returned a stored result without solving
+
+
+    # Create data model for problem
+    def create_data_model(self):
+        timings = {}
+        phase_start = ti.perf_counter()
+        instance = self.instance if self.instance is not None else get_shared_instance(self.city) # Reads the CSV files and builds the matrices on first use
+        phase_start = record_phase(timings, 'Instance', phase_start)
+        carriers = self.carriers
+
+        data = {}
+        data['city'] = self.city
+        data['toll'] = self.toll
+        data['carriers'] = carriers
+        data['nodes'] = get_nodes_from_instance(instance)
+        data['distance_total'] = instance['distance_total']
+        data['distance_inside'] = instance['distance_inside']
+        data['distance_outside'] = instance['distance_outside']
+        data['time_routes'] = instance['time_routes']
+        data['time_nodes'] = instance['service_times']
+        data['demands_g'] = instance['demands_kg'] * 1000
+        data['demands_liter'] = instance['demands_liter']
+        data['depot'] = 0
+        data['cost_matrices'] = {vehicle_type: get_cost_matrix(data, vehicle_type-1) for vehicle_type in sorted(set(self.vehicles))}
+        data['candidate_vehicles'] = self.vehicles
+        data['fleet_bounds'] = get_fleet_bounds(data, self.vehicles) if self.prune else None
+        vehicles = prune_fleet(self.vehicles, data['fleet_bounds']) if self.prune else self.vehicles
+        data['vehicles'] = vehicles
+        data['vehicle_payloads'] = [carriers['payloads'][i-1] for i in vehicles]
+        data['vehicle_volumes'] = [carriers['volumes'][i-1] for i in vehicles]
+        data['ranges'] = [carriers['ranges'][i-1] for i in vehicles]
+        data['num_vehicles'] = len(vehicles)
+        data['fss'] = self.fss
+        data['lss'] = self.lss
+        data['fss_string'] = self.fss_string
+        data['lss_string'] = self.lss_string
+        data['timeout'] = self.timeout
+        record_phase(timings, 'Data model', phase_start)
+        data['timings'] = timings
+        return data
+
+
+    # Solve the CVRP problem (stop_event can be any object with is_set(), e.g. a threading or multiprocessing Event)
+    # progress is called with each new entry of the search trace, see get_trace_callback()
+    # initial_routes/initial_types (e.g. csv_list[9] and csv_list[8] of a previous solve) warm-start the search, see repair_routes()
+    # time_limit overrides the scenario's timeout for this solve
+    # quick returns the NumPy savings plan (see get_savings_routes()) without any search, in well under a second
+    # The durations of all phases end up in self.timings, the console and csv_list[14]; set ROUTE_PROFILE to profile the solve, see profiling.py
+    @profiled
+    def solve(self, stop_event=None, progress=None, initial_routes=None, initial_types=None, time_limit=None, quick=False):
+        # Instantiate the data problem
+        time_limit = time_limit or self.timeout
+        data = self.create_data_model()
+        data['timeout'] = 0 if quick else time_limit
+        data['trace'] = []
+        self.timings = data['timings']
+        phase_start = ti.perf_counter()
+
+        # Check if provided vehicles have enough weight/volume to cover capacity (in theory) and can serve every customer
+        # (done for the candidate fleet, so that the output names its limits rather than those of the pruned fleet)
+        candidates = [vehicle_type-1 for vehicle_type in data['candidate_vehicles']]
+        payloads = [data['carriers']['payloads'][i] for i in candidates]
+        volumes = [data['carriers']['volumes'][i] for i in candidates]
+        impossible, out_string = check_infeasibility(payloads, volumes, data['demands_g'], data['demands_liter'])
+        if not impossible:
+            impossible, out_string = check_node_infeasibility(data['candidate_vehicles'], payloads, volumes, [data['carriers']['ranges'][i] for i in candidates], data['demands_g'], data['demands_liter'],
+                                                              data['time_nodes'], data['distance_total'], data['time_routes'], max_route_time, data['nodes']['Id'].tolist())
+        if impossible:
+            return out_string
+        phase_start = record_phase(data['timings'], 'Checks', phase_start)
+
+        # Create the routing index manager
+        manager = pywrapcp.RoutingIndexManager(len(data['distance_total']),
+                                               data['num_vehicles'], data['depot'])
+
+        # Create Routing Model
+        routing = pywrapcp.RoutingModel(manager)
+
+        # All transits are handed to the solver as precomputed integer matrices/vectors (indexed by node, not routing index)
+        # so that the search never has to call back into Python
+        distance_callback_index = routing.RegisterTransitMatrix(data['distance_total'].tolist())
+        routing.AddDimensionWithVehicleCapacity(distance_callback_index, 0, data['ranges'], True, 'Range')
+
+        # Define arc costs of each vehicle - one cost matrix per carrier type, shared by all vehicles of that type
+        # (vehicles with the same evaluator end up in the same cost class, so the solver caches their arc costs once)
+        type_callbacks = {vehicle_type: routing.RegisterTransitMatrix(cost_matrix.tolist()) for vehicle_type, cost_matrix in data['cost_matrices'].items()}
+        cost_callbacks = [type_callbacks[vehicle_type] for vehicle_type in data['vehicles']]
+        for vehicle_id, cost_callback_index in enumerate(cost_callbacks):
+            routing.SetArcCostEvaluatorOfVehicle(cost_callback_index, vehicle_id)
+
+        # Add Cost constraints
+        routing.AddDimensionWithVehicleTransits(cost_callbacks, 0, max_route_cost, True, 'Cost')
+        cost_dimension = routing.GetDimensionOrDie('Cost')
+        cost_dimension.SetGlobalSpanCostCoefficient(0) # Sets Global Span Coefficient to Zero - GSC would add costs for difference between longest and shortest route -> Forcing routes of similar length
+
+        # Add Capacity (Weight) constraint
+        payload_callback_index = routing.RegisterUnaryTransitVector(data['demands_g'].tolist())
+        routing.AddDimensionWithVehicleCapacity(payload_callback_index, 0,  data['vehicle_payloads'], True, 'Payload')
+
+        # Add Capacity (Volume) constraint
+        volume_callback_index = routing.RegisterUnaryTransitVector(data['demands_liter'].tolist())
+        routing.AddDimensionWithVehicleCapacity(volume_callback_index, 0, data['vehicle_volumes'], True, 'Volume')
+
+        # Add Time dimension (travel time to a node plus service time at that node)
+        time_callback_index = routing.RegisterTransitMatrix((data['time_routes'] + data['time_nodes'][None, :]).tolist())
+        routing.AddDimension(time_callback_index, 0, max_route_time, True, 'Time')
+
+        # Allow the search to be cancelled from outside and ended early by the stopping rules (checked at each solution, see get_trace_callback())
+        search_start = [ti.time()]
+        stop_reason = [None]
+        use_rules = any(self.stop_rules[rule] is not None for rule in ['stall_time', 'min_improvement', 'target_cost'])
+        def check_stop():
+            if stop_event is not None and stop_event.is_set():
+                return 'Cancelled'
+            return get_stop_reason(self.stop_rules, data['trace'], ti.time()-search_start[0]) if use_rules else None
+
+        # Seed the solver's random number generator (used e.g. by Simulated Annealing and random LNS moves)
+        if self.seed is not None:
+            routing.solver().ReSeed(self.seed)
+
+        # Setting solver parameters
+        try:
+            search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        except Exception as e:
+            print('Error occured: ', e)
+            input('Press any key to exit.')
+            return '', '', '', '', f'Error occurred while solving: {e}', '', f'{e}', False
+        search_parameters.first_solution_strategy = self.fss
+        search_parameters.local_search_metaheuristic = self.lss
+        search_parameters.time_limit.FromSeconds(max(time_limit, 1)) # Also limits reading the initial solution, so never 0
+
+        routing.CloseModelWithParameters(search_parameters) # Otherwise done by the solve, closing first keeps it out of the search time
+        phase_start = record_phase(data['timings'], 'Model', phase_start)
+
+        # Start from the NumPy savings plan instead of a first solution strategy of the solver
+        if initial_routes is None and (quick or self.fss_string == 'NumPy Savings'):
+            savings_start = ti.time()
+            initial_routes, initial_types = get_savings_routes(data)
+            print(f'Savings plan with {len(initial_routes)} routes built in {ti.time()-savings_start:.3f}s')
+
+        # Build the initial solution from previous routes (falls back to the first solution strategy if they cannot be repaired)
+        initial_assignment = None
+        if initial_routes is not None:
+            vehicle_routes = repair_routes(data, initial_routes, initial_types)
+            if vehicle_routes is not None:
+                initial_assignment = routing.ReadAssignmentFromRoutes([[manager.NodeToIndex(node) for node in route] for route in vehicle_routes], True)
+            if initial_assignment is None:
+                print('Previous routes could not be repaired, starting from scratch')
+
+        # Solve the problem
+        try:
+            busy_end = ti.strftime('%X', ti.localtime(ti.time()+time_limit))
+            print(f'\nSearching {self.city} with fleet {count_occurrences(self.vehicles)}')
+            if data['num_vehicles'] < self.num_vehicles:
+                print(f'pruned to {count_occurrences(data["vehicles"])} ({data["num_vehicles"]} of {self.num_vehicles} vehicles) by bounds {data["fleet_bounds"]}')
+            print(f'ending by latest: {busy_end}')
+            # print(search_parameters)
+            phase_start = record_phase(data['timings'], 'Initial solution', phase_start)
+            search_start[0] = ti.time()
+            trace_callback = get_trace_callback(routing, data['trace'], search_start[0], progress, check_stop if stop_event is not None or use_rules else None, stop_reason) # Keep callback referenced while solving
+            routing.AddAtSolutionCallback(trace_callback)
+            if quick:
+                solution = initial_assignment # The plan itself, without any search
+            elif initial_assignment is not None:
+                solution = routing.SolveFromAssignmentWithParameters(initial_assignment, search_parameters)
+            else:
+                solution = routing.SolveWithParameters(search_parameters)
+        except Exception as e:
+            return '', '', '', '', f'Error occurred while solving: {e}', '', f'{e}', False
+        data['stop_time'] = round(ti.time()-search_start[0], 3)
+        phase_start = record_phase(data['timings'], 'Search', phase_start)
+        data['stop_reason'] = 'Quick plan' if quick else stop_reason[0] or ('Time limit' if data['stop_time'] >= time_limit-0.5 else 'Search completed')
+
+
+        # Print solution on console
+        if solution:
+            routes, load, dist, time, cost, fleet, params, csv_list = print_solution(data, manager, routing, solution)
+            record_phase(data['timings'], 'Solution', phase_start)
+            phases_string = f'Phases: {format_timings(data["timings"])}'
+            print(phases_string)
+            return routes, load, dist, time, cost, fleet, f'{params}\n{phases_string}', csv_list + [data['timings']]
+        else:
+            return 'No solution could be found!', '', 'Please check your chosen parameters for feasibility.', '', 'No solution could be found!', '', 'No solution could be found', False
+
+
+    # Solve the CVRP problem, returning the stored result instantly if the exact same request was solved before
+    # With improve_time > 0 a cached result is improved by a further search of that many seconds, warm-started from its routes
+    # Cancelled searches are not cached
+    # On a cache hit self.cache_hit holds the run time of the original solve, so that callers can store the result as a replay of it
+    def cached_solve(self, improve_time=0, stop_event=None, progress=None):
+        key = get_result_key(self.city, self.vehicles, self.toll, self.fss_string, self.lss_string, self.timeout, self.seed, self.carriers, self.stop_rules)
+        cached = load_result(key)
+        result, run_time = cached if cached is not None else (None, 0)
+        self.cache_hit = None
+        if result is not None and not improve_time:
+            print(f'\nReturning cached result for {self.city} with fleet {count_occurrences(self.vehicles)}')
+            self.cache_hit = run_time
+            routes, load, dist, time, cost, fleet, params, csv_list = result
+            return routes, load, dist, time, cost, fleet, f'{params}\nResult loaded from cache', csv_list
+
+        start_time = ti.time()
+        if result is None:
+            new_result = self.solve(stop_event, progress)
+        else:
+            new_result = self.solve(stop_event, progress, initial_routes=result[7][9], initial_types=result[7][8], time_limit=improve_time)
+        if new_result[7] and (result is None or new_result[7][0] < result[7][0]):
+            result = new_result
+            if stop_event is None or not stop_event.is_set():
+                store_result(key, result, round(run_time + ti.time()-start_time, 3)) # Improved results count the time of all their searches
+        return result if result is not None else new_result
+
+
+    # Races several FSS/LSS/seed combinations on this scenario in parallel processes and returns the best solution
+    # All members share one wall-clock budget of timeout seconds; with fewer workers than members, members run in rounds with a share of it
+    def solve_portfolio(self, members=None, workers=None):
+        members = members or portfolio
+        workers = min(workers or mp.cpu_count(), len(members))
+        member_timeout = max(1, self.timeout // ceil(len(members)/workers))
+        arguments = {'vehicles': list(self.vehicles), 'city': self.city, 'toll': self.toll, 'instance': self.instance, 'prune': self.prune, 'stop_rules': self.stop_rules, 'carriers': self.carriers}
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as pool:
+            results = list(pool.map(solve_portfolio_member, [arguments]*len(members), members, [member_timeout]*len(members)))
+
+        # Rank members by total cost of their solution (members without solution have csv_list False)
+        summaries = []
+        best = None
+        for member, result in zip(members, results):
+            csv_list = result[7]
+            summaries.append(f'{member[0]} + {member[1]} (seed {member[2]}): ' + (f'{csv_list[0]}€' if csv_list else 'no solution'))
+            if csv_list and (best is None or csv_list[0] < results[best][7][0]):
+                best = len(summaries)-1
+        if best is None:
+            return results[0]
+
+        winner = f'{members[best][0]} + {members[best][1]} (seed {members[best][2]})'
+        portfolio_string = f'Portfolio winner: {winner} out of {len(members)} members with t={member_timeout}s each\n' + '\n'.join(summaries)
+        routes, load, dist, time, cost, fleet, params, csv_list = results[best]
+        print(portfolio_string)
+        return routes, load, dist, time, cost, fleet, f'{params}\n{portfolio_string}', csv_list + [winner]
+
+
+
+# Default scenario of the module-level functions below - adjusted from GUI/scripts through set_variables()
+scenario = Scenario(repeat(arange(1, 8), 20), 'Shanghai', 200, 'Automatic FSS', 'Automatic LSS', 10800)
+
+
+
+# Set search parameters from outside (replaces the default scenario)
+def set_variables(new_vehicles, new_city, new_toll, new_fss, new_lss, new_time, new_seed=None):
+    global scenario
+    scenario = Scenario(new_vehicles, new_city, new_toll, new_fss, new_lss, new_time, new_seed)
+
+
+
+# Module-level shortcuts for the default scenario
+def create_data_model():
+    return scenario.create_data_model()
+
+
+def main(stop_event=None, progress=None, initial_routes=None, initial_types=None):
+    return scenario.solve(stop_event, progress, initial_routes, initial_types)
+
+
+def cached_main(improve_time=0, stop_event=None, progress=None):
+    return scenario.cached_solve(improve_time, stop_event, progress)
+
+
+def solve_portfolio(members=None, workers=None):
+    return scenario.solve_portfolio(members, workers)
 
 
 
 if __name__ == '__main__':
     # Only relevant if route_planning.py is executed as the main program, i.e. in testing (never from GUI)
-    def manual_routing(new_fleets, new_cities, new_tolls, new_fsss, new_lsss, new_timeouts):
+    def manual_routing(new_fleets, new_cities, new_tolls, new_fsss, new_lsss, new_timeouts, use_portfolio=False):
         for id, _ in enumerate(new_fleets):
             if {len(new_fleets), len(new_cities), len(new_tolls), len(new_fsss), len(new_lsss), len(new_timeouts)} == {len(new_fleets)}:
                 set_variables(new_fleets[id], new_cities[id], new_tolls[id], new_fsss[id], new_lsss[id], new_timeouts[id])
                 start_time = ti.time()
-                routes, load, dist, time, cost, fleet, params, csv_list = main()
+                routes, load, dist, time, cost, fleet, params, csv_list = solve_portfolio() if use_portfolio else cached_main()
                 end_time = ti.time()
                 run_time = round(end_time-start_time, 3)
+                cached = not use_portfolio and scenario.cache_hit is not None
                 if csv_list:
-                    print(write_to_csv(csv_list, city, int(toll/10), timeout, run_time, routes))
+                    timings = {}
+                    phase_start = ti.perf_counter()
+                    print(write_result(csv_list, scenario.city, int(scenario.toll/10), scenario.fss_string, scenario.lss_string, scenario.timeout, scenario.cache_hit if cached else run_time, scenario.vehicles,
+                                       status='Cached' if cached else None))
+                    record_phase(timings, 'Result write', phase_start)
+                    print(f'Output phases: {format_timings(timings)}')
             else:
                 print(f'Illegal array length: {len(new_fleets)} {len(new_cities)} {len(new_tolls)} {len(new_fsss)} {len(new_lsss)} {len(new_timeouts)}')
 
@@ -0,0 +1,261 @@
+""" Batch runner for scenario sweeps (cities x tolls x FSS x LSS x timeouts x fleets) """
+""" Scenarios are solved in parallel worker processes, each as its own route_planning.Scenario """
+""" Finished scenarios are journaled to output/<name>.jsonl, so a killed sweep continues where it stopped when re-run """
+""" Results are appended in batches to the results store (see result_store.py): load_results(sweep=<name>) loads all of them at once """
+""" Usage: python sweep.py --cities NewYork1 NewYork2 --tolls 0 100 250 400 --lss 'Guided Local Search' --timeouts 1800 --workers 4 """
+"""    or: python sweep.py --spec sweep.json (JSON object with any of the keys below, command line values take precedence) """
+""" Toll sensitivity: python sweep.py --cities Paris --toll-range 0 10000 100 --lss 'Guided Local Search' --timeouts 600 """
+"""    re-costs found route plans for every toll and only re-solves (warm-started) where the cheapest plan may change """
+""" Scenarios end early once converged with --stall 120 (no improvement for 120s) and/or --min-improvement 0.001 --window 300 """
+""" --maps output/maps saves a map of every solved scenario there (rendered headless in the workers, --map-format png or svg) """
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time as ti
+from hashlib import sha1
+from itertools import product
+from numpy import arange, array, zeros
+from pandas import DataFrame
+from route_planning import Scenario, carriers, get_carriers
+from result_store import append_results, get_store_row, write_result
+from utils import draw_routes, generate_vehicles, get_csv_row, load_instance
+
+store_batch = 20 # Finished scenarios appended to the results store at once
+
+# Defaults of a sweep spec - tolls are in 0.1ct/km as in route_planning.Scenario, fleets are numbers of vehicles per type
+default_spec = {
+    'cities': ['Paris'],
+    'tolls': [0],
+    'fss': ['Automatic FSS'],
+    'lss': ['Automatic LSS'],
+    'timeouts': [60],
+    'fleets': [[20, 20, 20, 20, 20, 20, 20]]
+}
+
+
+# Function to expand a sweep spec into the list of all its scenarios
+# Optional stopping rules of the spec (see route_planning.default_stop_rules) apply to all scenarios
+def get_scenarios(spec):
+    spec = default_spec | spec
+    stop_rules = {'stop_rules': spec['stop_rules']} if spec.get('stop_rules') else {}
+    return [{'city': city, 'toll': toll, 'fss': fss, 'lss': lss, 'timeout': timeout, 'fleet': list(fleet)} | stop_rules
+            for fleet, city, toll, fss, lss, timeout in product(spec['fleets'], spec['cities'], spec['tolls'], spec['fss'], spec['lss'], spec['timeouts'])]
+
+
+# Function to get a stable key for a scenario (used for resuming and as default sweep name)
+def get_scenario_key(scenario):
+    return json.dumps(scenario, sort_keys=True)
+
+
+# Function to read the entries (result row and store row) of all scenarios already finished in a sweep journal
+def read_journal(journal):
+    finished = {}
+    if os.path.exists(journal):
+        with open(journal, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # Last line may be cut off if the sweep was killed while writing
+                finished[entry['key']] = entry
+    return finished
+
+
+# Function to get the file a scenario's map is saved to, e.g. output/maps/sweep_1a2b3c4d/Paris_0123456789.png
+def get_map_path(maps, name, scenario, key, map_format):
+    return f'{maps}/{name}/{scenario["city"]}_{sha1(key.encode()).hexdigest()[:10]}.{map_format}'
+
+
+# Function to solve a single scenario - runs in a worker process
+# Returns the journal entry of the scenario: its result row (for output/<name>.csv) and its row for the results store
+# With maps the routes are also drawn to a file in that directory
+def run_scenario(scenario, name, key, maps=None, map_format='png'):
+    start_time = ti.time()
+    vehicles = generate_vehicles(scenario['fleet'])
+    solver = Scenario(vehicles, scenario['city'], scenario['toll'], scenario['fss'], scenario['lss'], scenario['timeout'], stop_rules=scenario.get('stop_rules'))
+    routes, load, dist, time, cost, fleet, params, csv_list = solver.cached_solve()
+    run_time = round(ti.time()-start_time, 3) if solver.cache_hit is None else solver.cache_hit # Replays of cached results keep the run time of their solve
+    status = 'Cached' if solver.cache_hit is not None else 'Solved' if csv_list else dist or cost
+    store_row = get_store_row(csv_list, scenario['city'], int(scenario['toll']/10), scenario['fss'], scenario['lss'], scenario['timeout'], run_time, vehicles,
+                              stop_rules=scenario.get('stop_rules'), status=status, sweep=name, scenario_key=key)
+    if csv_list:
+        row = get_csv_row(csv_list, scenario['city'], int(scenario['toll']/10), scenario['timeout'], run_time, routes)
+        row['Status'] = status
+        if maps:
+            row['Map'] = draw_routes(csv_list[7], csv_list[8], csv_list[9], csv_list[10], scenario['city'], get_map_path(maps, name, scenario, key, map_format))
+    else:
+        row = {'City': scenario['city'], 'Toll [ct]': int(scenario['toll']/10), 'Construction heuristic': scenario['fss'], 'Metaheuristic': scenario['lss'],
+               'Max_Time [s]': scenario['timeout'], 'Actual_Time [s]': run_time, 'Status': dist or cost}
+    row['Fleet_Candidates'] = str(scenario['fleet'])
+    return {'key': key, 'row': {column: value.item() if hasattr(value, 'item') else value for column, value in row.items()}, 'store': store_row}
+
+
+# Function to solve a scenario of a sweep in a worker process without ending the sweep if it fails - returns its key, journal entry and error
+def run_sweep_task(task):
+    key, scenario, name, maps, map_format = task
+    try:
+        return key, run_scenario(scenario, name, key, maps, map_format), None
+    except Exception as e:
+        return key, None, e
+
+
+# Function to run all scenarios of a sweep on a process pool, skipping those already in the journal
+def run_sweep(spec, workers=None, name=None, maps=None, map_format='png'):
+    scenarios = get_scenarios(spec)
+    keys = [get_scenario_key(scenario) for scenario in scenarios]
+    name = name or 'sweep_' + sha1('\n'.join(keys).encode()).hexdigest()[:8]
+    os.makedirs('output', exist_ok=True)
+    journal = f'output/{name}.jsonl'
+    finished = read_journal(journal)
+    todo = [(key, scenario) for key, scenario in zip(keys, scenarios) if key not in finished]
+    print(f'Sweep {name}: {len(scenarios)} scenarios, {len(scenarios)-len(todo)} already done, {len(todo)} to run')
+
+    # One fresh process per scenario, so the memory of a solver is released after each scenario of a long sweep
+    # (multiprocessing.Pool with maxtasksperchild, as ProcessPoolExecutor(max_tasks_per_child) needs Python 3.11 and the build uses 3.10)
+    if todo:
+        with mp.get_context('spawn').Pool(workers, maxtasksperchild=1) as pool:
+            batch = []
+            with open(journal, 'a', encoding='utf-8') as f:
+                for key, entry, error in pool.imap_unordered(run_sweep_task, [(key, scenario, name, maps, map_format) for key, scenario in todo]):
+                    if error is not None:
+                        print(f'Scenario {key} failed: {error}')
+                        continue
+                    finished[key] = entry
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                    f.flush()
+                    row = entry['row']
+                    print(f'[{len(finished)}/{len(scenarios)}] {row["City"]} toll={row["Toll [ct]"]}ct: {row["Status"]}')
+                    batch.append(entry['store'])
+                    if len(batch) >= store_batch:
+                        append_results(batch)
+                        batch = []
+
+    # Store all finished scenarios, including those of an interrupted earlier run (the store skips the ones it already has)
+    stored = append_results([finished[key]['store'] for key in keys if key in finished and finished[key].get('store')])
+    rows = [finished[key]['row'] for key in keys if key in finished]
+    DataFrame(rows).to_csv(f'output/{name}.csv', index=False, sep=';')
+    print(f'Results of {len(rows)} scenarios written to output/{name}.csv ({stored} new in the results store, load them with load_results(sweep={name!r}))')
+    return rows
+
+
+# Function to get the km driven inside and outside the toll zone per carrier type by a route plan (routes incl. depot)
+# Route cost is linear in the toll: inside_km*(cpkm+toll) + outside_km*cpkm for tolled types, so these km are all re-costing needs
+def get_plan_km(instance, routes, types):
+    inside = zeros(len(carriers['ids']))
+    outside = zeros(len(carriers['ids']))
+    for route, vehicle_type in zip(routes, types):
+        inside[vehicle_type-1] += instance['distance_inside'][route[:-1], route[1:]].sum()/1000
+        outside[vehicle_type-1] += instance['distance_outside'][route[:-1], route[1:]].sum()/1000
+    return inside, outside
+
+
+# Function to re-cost route plans for many tolls at once - returns cost [€] as array of shape (plans, tolls)
+# plans_inside/plans_outside are km per carrier type of each plan, cpkm_outside in 0.1ct/km and tolls in 0.1ct/km
+def recost_plans(plans_inside, plans_outside, cpkm_outside, tolls):
+    tolled = arange(len(cpkm_outside)) < 3 # Only carrier types 1-3 pay the toll
+    base = (plans_inside + plans_outside) @ array(cpkm_outside)
+    slope = plans_inside[:, tolled].sum(axis=1)
+    return (base[:, None] + slope[:, None]*array(tolls)[None, :]) / 1000
+
+
+# Function to compute the cheapest route plan for every toll of a sweep with as few OR-Tools solves as possible
+# The cheapest of all plans is a concave, piecewise linear function of the toll: if the same plan is cheapest at both ends of a
+# toll interval it is cheapest in all of it, otherwise the interval is split at the toll where the two plans cost the same,
+# which is re-solved (warm-started from the cheapest known plan) and only kept if it finds a cheaper plan
+def run_toll_sweep(city, fleet, tolls, fss, lss, timeout, name=None, max_solves=10, stop_rules=None):
+    tolls = sorted(set(tolls))
+    vehicles = generate_vehicles(fleet)
+    instance = load_instance(city)
+    name = f'{name}_{city}' if name else f'tollsweep_{city}_{tolls[0]}-{tolls[-1]}_{timeout}' # One output per city, also when several cities share a --name
+    os.makedirs('output', exist_ok=True)
+    plans = []
+
+    def solve_at(toll, warm_plan=None):
+        start_time = ti.time()
+        routes, load, dist, time, cost, fleet_string, params, csv_list = Scenario(vehicles, city, toll, fss, lss, timeout, instance=instance, stop_rules=stop_rules).solve(initial_routes=warm_plan['routes'] if warm_plan else None, initial_types=warm_plan['types'] if warm_plan else None)
+        run_time = round(ti.time()-start_time, 3)
+        if not csv_list:
+            print(f'No solution for toll {toll}: {dist or cost}')
+            return None
+        write_result(csv_list, city, int(toll/10), fss, lss, timeout, run_time, vehicles, sweep=name)
+        inside, outside = get_plan_km(instance, csv_list[9], csv_list[8])
+        plans.append({'toll': toll, 'routes': csv_list[9], 'types': csv_list[8], 'inside': inside, 'outside': outside, 'fleet': csv_list[1]})
+        return plans[-1]
+
+    def recost(at_tolls):
+        return recost_plans(array([plan['inside'] for plan in plans]), array([plan['outside'] for plan in plans]), get_carriers(city, 0)['cpkm_outside'], at_tolls)
+
+    if solve_at(tolls[0]) is None:
+        return []
+    solve_at(tolls[-1], plans[0])
+    intervals = [(tolls[0], tolls[-1])]
+    while intervals and len(plans) < max_solves:
+        low, high = intervals.pop()
+        costs = recost([low, high])
+        plan_low, plan_high = costs[:, 0].argmin(), costs[:, 1].argmin()
+        if plan_low == plan_high:
+            continue
+        # Toll where both plans cost the same, snapped to the closest toll of the sweep strictly inside the interval
+        slope_low = (costs[plan_low, 1]-costs[plan_low, 0]) / (high-low)
+        slope_high = (costs[plan_high, 1]-costs[plan_high, 0]) / (high-low)
+        crossing = low + (costs[plan_high, 0]-costs[plan_low, 0]) / (slope_low-slope_high)
+        inner = [toll for toll in tolls if low < toll < high]
+        if not inner:
+            continue
+        toll = min(inner, key=lambda t: abs(t-crossing))
+        best_known = recost([toll])[:, 0]
+        plan = solve_at(toll, plans[best_known.argmin()])
+        if plan is not None and recost([toll])[-1, 0] < best_known.min() - 1e-6:
+            intervals += [(low, toll), (toll, high)]
+
+    costs = recost(tolls)
+    best = costs.argmin(axis=0)
+    rows = [{'City': city, 'Toll [ct]': int(toll/10), 'Total_Cost [€]': round(costs[plan_id, toll_id], 3), 'Plan': int(plan_id),
+             'Plan_Solved_At_Toll [ct]': int(plans[plan_id]['toll']/10), 'Fleet': plans[plan_id]['fleet'],
+             'Tolled_Inside [km]': round(plans[plan_id]['inside'][:3].sum(), 3)} for toll_id, (toll, plan_id) in enumerate(zip(tolls, best))]
+    DataFrame(rows).to_csv(f'output/{name}.csv', index=False, sep=';')
+    print(f'Toll sweep over {len(tolls)} tolls needed {len(plans)} solves, {len(set(best))} different plans are cheapest. Written to output/{name}.csv')
+    return rows
+
+
+# Function to read a sweep spec from a JSON file and/or the command line
+def parse_spec(args):
+    spec = {}
+    if args.spec:
+        with open(args.spec, encoding='utf-8') as f:
+            spec = json.load(f)
+    for key in default_spec:
+        if getattr(args, key) is not None:
+            spec[key] = getattr(args, key)
+    stop_rules = {rule: getattr(args, rule) for rule in ['stall_time', 'min_improvement', 'window'] if getattr(args, rule) is not None}
+    if stop_rules:
+        spec['stop_rules'] = spec.get('stop_rules', {}) | stop_rules
+    return spec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a sweep of routing scenarios in parallel')
+    parser.add_argument('--spec', help='JSON file with the sweep spec')
+    parser.add_argument('--cities', nargs='+')
+    parser.add_argument('--tolls', nargs='+', type=int, help='tolls in 0.1ct/km')
+    parser.add_argument('--fss', nargs='+')
+    parser.add_argument('--lss', nargs='+')
+    parser.add_argument('--timeouts', nargs='+', type=int)
+    parser.add_argument('--fleets', nargs=7, type=int, action='append', metavar='N', help='vehicles per type 1-7 (repeatable)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--name', help='sweep name (defaults to a hash of the scenarios, so re-running resumes; toll sweeps add the city to it)')
+    parser.add_argument('--toll-range', nargs=3, type=int, metavar=('START', 'STOP', 'STEP'), help='toll sensitivity sweep in 0.1ct/km (STOP included) instead of a scenario sweep')
+    parser.add_argument('--stall', dest='stall_time', type=int, help='end a scenario after this many seconds without improvement')
+    parser.add_argument('--min-improvement', type=float, help='end a scenario once its cost improved by less than this share over --window seconds')
+    parser.add_argument('--window', type=int, help='seconds over which --min-improvement is measured (default 60)')
+    parser.add_argument('--maps', help='directory to save a map of every solved scenario to')
+    parser.add_argument('--map-format', choices=['png', 'svg'], default='png')
+    parser.add_argument('--max-solves', type=int, default=10, help='maximum number of OR-Tools solves per toll sensitivity sweep')
+    args = parser.parse_args()
+    if args.toll_range:
+        spec = default_spec | parse_spec(args)
+        for city in spec['cities']:
+            run_toll_sweep(city, spec['fleets'][0], range(args.toll_range[0], args.toll_range[1]+1, args.toll_range[2]), spec['fss'][0], spec['lss'][0], spec['timeouts'][0], args.name, args.max_solves, spec.get('stop_rules'))
+    else:
+        run_sweep(parse_spec(args), args.workers, args.name, args.maps, args.map_format)
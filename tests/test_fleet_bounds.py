@@ -0,0 +1,48 @@
+""" Tests of the fleet bounds used to prune the candidate fleet before solving (route_planning.get_fleet_bounds) """
+from numpy import array, int64, zeros
+from route_planning import Scenario, get_depot_slack
+
+
+# Function to get an instance of a depot and two customers that are 1km from the depot but 100km from each other,
+# so that the cheapest plan serves each customer on its own route and merging them costs far more (positive cost slack)
+def get_slack_instance():
+    distances = array([[0, 1000, 1000], [1000, 0, 100000], [1000, 100000, 0]], dtype=int64)
+    return {
+        'ids': array(['D0', 'C1', 'C2']),
+        'lon': array([0.0, 0.01, -0.01]),
+        'lat': array([0.0, 0.0, 0.0]),
+        'demands_kg': array([0, 10, 10], dtype=int64),
+        'demands_liter': array([0, 10, 10], dtype=int64),
+        'service_times': zeros(3, dtype=int64),
+        'distance_total': distances,
+        'distance_inside': zeros((3, 3), dtype=int64),
+        'distance_outside': distances,
+        'time_routes': zeros((3, 3), dtype=int64)
+    }
+
+
+# Function to get a carrier table with a single type that can serve both customers on one route (1€/km, no toll)
+def get_single_type_carriers():
+    return {'ids': [1], 'payloads': [1000000], 'volumes': [1000], 'ranges': [1000000], 'cpkm_outside': [1000], 'cpkm_inside': [1000]}
+
+
+def get_scenario(prune=True):
+    return Scenario([1]*5, 'SlackTest', 0, 'Automatic FSS', 'Guided Local Search', 1, seed=0, instance=get_slack_instance(), prune=prune, carriers=get_single_type_carriers())
+
+
+def test_instance_has_positive_cost_slack():
+    data = get_scenario().create_data_model()
+    assert get_depot_slack(data['cost_matrices'][1]) > 0
+
+
+def test_bounds_keep_optimal_mix_with_positive_cost_slack():
+    # Optimal: both customers on their own route, i.e. 2 vehicles of type 1 for 4km = 4€
+    lower, upper = get_scenario().create_data_model()['fleet_bounds'][1]
+    assert lower <= 2 <= upper
+
+
+def test_pruned_solve_finds_optimum_with_positive_cost_slack():
+    pruned = get_scenario().solve()[7]
+    unpruned = get_scenario(prune=False).solve()[7]
+    assert pruned[0] == unpruned[0] == 4.0
+    assert pruned[8] == [1, 1]
@@ -0,0 +1,55 @@
+""" Tests of the checks that reject impossible scenarios before solving (utils.check_node_infeasibility) """
+from numpy import array, full, int64, zeros
+from utils import check_node_infeasibility
+
+
+# Function to get a line instance: depot 0 - node 1 - node 2 with 1km per step, but the direct arc between the depot and node 2 is 100km
+# (the matrix violates the triangle inequality, so node 2 is only within a short range when reached through node 1)
+def get_line_distances():
+    return array([[0, 1000, 100000], [1000, 0, 1000], [100000, 1000, 0]], dtype=int64)
+
+
+# Function to run the check for a fleet of identical vehicles with the given payload and range (volumes and times do not bind)
+def check(weights, distances, num_vehicles=2, payload=1000, vehicle_range=1000000, max_time=36000):
+    num_nodes = len(weights)
+    return check_node_infeasibility([1]*num_vehicles, [payload]*num_vehicles, [1000]*num_vehicles, [vehicle_range]*num_vehicles, array(weights, dtype=int64),
+                                    zeros(num_nodes, dtype=int64), zeros(num_nodes, dtype=int64), distances, distances // 10, max_time,
+                                    array(['D0'] + [f'C{node}' for node in range(1, num_nodes)]))
+
+
+# Function to get distances of 1km between all nodes
+def get_uniform_distances(num_nodes):
+    distances = full((num_nodes, num_nodes), 1000, dtype=int64)
+    distances[range(num_nodes), range(num_nodes)] = 0
+    return distances
+
+
+def test_customer_heavier_than_every_vehicle_is_rejected():
+    impossible, output = check([0, 500, 2000], get_uniform_distances(3))
+    assert impossible
+    assert 'Customer C2' in output[2] and 'payload 1.0kg' in output[2]
+    assert output[6] == 'No solution possible due to customer C2 fitting no vehicle'
+
+
+def test_customer_reached_through_another_node_is_not_rejected():
+    # Direct round trip to node 2 is 200km, through node 1 it is 4km
+    assert check([0, 100, 100], get_line_distances(), vehicle_range=4000) == (False, '')
+
+
+def test_customer_out_of_range_even_through_other_nodes_is_rejected():
+    impossible, output = check([0, 100, 100], get_line_distances(), vehicle_range=3999)
+    assert impossible
+    assert 'Customer C2' in output[2] and 'round trip 4.0km' in output[2]
+
+
+def test_more_large_customers_than_vehicles_are_rejected():
+    # 1.8kg fit into the 2kg of two vehicles by weight, but each 0.6kg customer needs its own 1kg vehicle
+    impossible, output = check([0, 600, 600, 600], get_uniform_distances(4))
+    assert impossible
+    assert output[6] == 'No solution possible due to too few vehicles for large weight demands'
+
+
+def test_tight_feasible_instance_is_not_rejected():
+    # Full payload on both vehicles (0.5kg + 0.5kg and 1kg), each route exactly as long as the range and time limit
+    distances = get_uniform_distances(4)
+    assert check([0, 500, 500, 1000], distances, vehicle_range=3000, max_time=300) == (False, '')
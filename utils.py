@@ -1,9 +1,11 @@
-from pandas import read_csv, DataFrame
-from numpy import sum
+from pandas import read_csv, DataFrame, Series
+from numpy import sum, asarray, frombuffer, load, save, int32, int64, uint8, arange, isnan, flatnonzero, minimum, zeros, where, iinfo, sort, concatenate
 from math import floor
+from hashlib import sha1
+import json
+import os
 from collections import defaultdict
 from ortools.constraint_solver import routing_enums_pb2
-import matplotlib.pyplot as plt
 from time import strftime, localtime
 
 
@@ -34,6 +36,18 @@ def time_to_int(time):
     return (hours*3600 + minutes*60 + seconds)
 
 
+# Function to convert a whole column of times (XX:XX:XX) to int seconds in one vectorised pass
+def times_to_int(times):
+    chars = asarray(times, dtype=str).astype('S8')
+    digits = frombuffer(chars.tobytes(), dtype=uint8).reshape(-1, 8).astype(int32) - ord('0')
+    separators = digits[:, [2, 5]] == ord(':') - ord('0')
+    numbers = digits[:, [0, 1, 3, 4, 6, 7]]
+    invalid = ~(separators.all(axis=1) & ((numbers >= 0) & (numbers <= 9)).all(axis=1))
+    if invalid.any():
+        raise ValueError(f'{times[flatnonzero(invalid)[0]]} is not a valid time.\nAcceptable format is: HH:MM:SS')
+    return (numbers[:, 0]*10 + numbers[:, 1])*3600 + (numbers[:, 2]*10 + numbers[:, 3])*60 + numbers[:, 4]*10 + numbers[:, 5]
+
+
 # Function to convert from integer seconds to time (XX:XX:XX)
 def int_to_time(seconds):
     hours = floor(seconds/3600)
@@ -56,58 +70,174 @@ def get_routes(city):
     return read_csv(f'./instances/{city}.routes', sep=' ')
 
 
-# Function to calculate a distance matrix from .routes format data
-def get_distance_matrix_from_routes(routes, num_nodes, dist_type):
-    # Returns distance matrix computed from custom .routes format
-    valid = ['Total', 'Inside', 'Outside']
-    if dist_type not in valid:
-        raise ValueError(f"{dist_type} is not a valid distance type.\nAcceptable values are: {valid}")
-    km_list = routes[f'Distance{dist_type}[km]']
-    m_list = [int(1000 * x) for x in km_list] 
-    # km_matrix = list(zip(*([iter(routes[f'Distance{dist_type}[km]'])]*num_nodes)))
-    m_matrix = list(zip(*([iter(m_list)]*num_nodes)))
-    return m_matrix
+# Names of the arrays stored in the compiled instance cache at /instances/.cache/<city>/<name>.npy
+instance_arrays = ['ids', 'lon', 'lat', 'demands_kg', 'demands_liter', 'service_times', 'distance_total', 'distance_inside', 'distance_outside', 'time_routes']
+instance_cache_version = 2
+routes_chunk_rows = 1 << 18 # Rows of a .routes file parsed at once
+
+
+# Function to get mtime, size and SHA-1 hash of an instance source file
+def get_file_signature(path, with_hash=True):
+    stat = os.stat(path)
+    signature = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    if with_hash:
+        file_hash = sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                file_hash.update(chunk)
+        signature['sha1'] = file_hash.hexdigest()
+    return signature
+
+
+# Function to check whether the compiled cache of a city still matches its .nodes/.routes files
+# Unchanged mtime and size are trusted, otherwise the files are re-hashed (touching a file does not force a rebuild)
+def instance_cache_valid(cache_dir, sources):
+    try:
+        with open(f'{cache_dir}/meta.json') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if meta.get('version') != instance_cache_version or set(meta.get('sources', {})) != set(sources):
+        return False
+    if not all(os.path.exists(f'{cache_dir}/{name}.npy') for name in instance_arrays):
+        return False
+
+    refreshed = False
+    for key, path in sources.items():
+        cached = meta['sources'][key]
+        current = get_file_signature(path, with_hash=False)
+        if current['mtime_ns'] == cached['mtime_ns'] and current['size'] == cached['size']:
+            continue
+        if current['size'] != cached['size'] or get_file_signature(path)['sha1'] != cached['sha1']:
+            return False
+        cached['mtime_ns'] = current['mtime_ns']
+        refreshed = True
+
+    if refreshed:
+        write_instance_meta(cache_dir, meta)
+    return True
+
+
+# Function to atomically write the metadata file of a compiled instance cache
+def write_instance_meta(cache_dir, meta):
+    with open(f'{cache_dir}/meta.json.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(f'{cache_dir}/meta.json.tmp', f'{cache_dir}/meta.json')
 
 
-# Function to get a time matrix from .routes format data
-def get_time_matrix_from_routes(routes, num_nodes):
-    # Returns distance matrix computed from custom .routes format
-    time_list = routes['Duration[s]']
-    s_list = [time_to_int(x) for x in time_list]
-    s_matrix = list(zip(*([iter(s_list)]*num_nodes)))
-    return s_matrix
+# Function to parse the text instance of a city into integer NumPy arrays
+def compile_instance(city):
+    nodes = get_nodes(city)
+    return {
+        'ids': asarray(nodes['Id'].values, dtype=str),
+        'lon': asarray(nodes['Lon'].values, dtype=float),
+        'lat': asarray(nodes['Lat'].values, dtype=float),
+        'demands_kg': asarray(nodes['Demand[kg]'].values, dtype=int32),
+        'demands_liter': asarray(nodes['Demand[m^3*10^-3]'].values, dtype=int32),
+        'service_times': get_time_list_from_nodes(nodes)
+    } | read_routes_matrices(city, asarray(nodes['Id'].values, dtype=str))
+
+
+# Function to write a compiled instance to /instances/.cache/<city>/ as one .npy file per array
+# Arrays are written to temporary files first, so that concurrent readers never see half-written files
+def write_instance_cache(cache_dir, instance, sources):
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in instance_arrays:
+        with open(f'{cache_dir}/{name}.npy.tmp', 'wb') as f:
+            save(f, instance[name])
+        os.replace(f'{cache_dir}/{name}.npy.tmp', f'{cache_dir}/{name}.npy')
+    meta = {'version': instance_cache_version, 'sources': {key: get_file_signature(path) for key, path in sources.items()}}
+    write_instance_meta(cache_dir, meta)
+
+
+# Function to load a city instance as read-only memory-mapped arrays from the compiled cache
+# The cache is (re)built from the .nodes/.routes files whenever it is missing or out of date
+def load_instance(city, use_cache=True):
+    cache_dir = f'./instances/.cache/{city}'
+    sources = {'nodes': f'./instances/{city}.nodes', 'routes': f'./instances/{city}.routes'}
+    if use_cache and instance_cache_valid(cache_dir, sources):
+        return {name: load(f'{cache_dir}/{name}.npy', mmap_mode='r') for name in instance_arrays}
+
+    instance = compile_instance(city)
+    if use_cache:
+        try:
+            write_instance_cache(cache_dir, instance, sources)
+        except OSError as e:
+            print(f'Could not write instance cache for {city}: {e}')
+    return instance
+
+
+# Function to get a nodes table (Id, Lon, Lat) from a loaded instance, e.g. for plotting
+def get_nodes_from_instance(instance):
+    return DataFrame({'Id': instance['ids'], 'Lon': instance['lon'], 'Lat': instance['lat']})
+
+
+# Function to stream the .routes file of a city in chunks straight into preallocated matrices (distances in m truncated to full metres, times in s)
+# Peak memory stays close to the matrices themselves, as only one chunk of rows is parsed at a time
+# Rows may come in any order; missing self-loops (X -> X) stay zero, any other missing, duplicate or unknown route is an error
+def read_routes_matrices(city, ids):
+    num_nodes = len(ids)
+    positions = Series(arange(num_nodes), index=ids)
+    matrices = {name: zeros(num_nodes*num_nodes, dtype=int32) for name in ['distance_total', 'distance_inside', 'distance_outside', 'time_routes']}
+    seen = zeros(num_nodes*num_nodes, dtype=bool)
+    first_row = 0
+    columns = {'From': str, 'To': str, 'DistanceTotal[km]': float, 'DistanceInside[km]': float, 'DistanceOutside[km]': float, 'Duration[s]': str}
+    for routes in read_csv(f'./instances/{city}.routes', sep=' ', usecols=list(columns), dtype=columns, chunksize=routes_chunk_rows):
+        from_pos = positions.reindex(routes['From'].values).values
+        to_pos = positions.reindex(routes['To'].values).values
+        unknown = isnan(from_pos) | isnan(to_pos)
+        if unknown.any():
+            row = flatnonzero(unknown)[0]
+            raise ValueError(f'Route {first_row+row} ({routes["From"].iat[row]}->{routes["To"].iat[row]}) refers to a node missing from the .nodes file.')
+        flat = (from_pos*num_nodes + to_pos).astype(int64)
+        arcs = sort(flat)
+        repeated = concatenate([arcs[1:][arcs[1:] == arcs[:-1]], flat[seen[flat]]])
+        if len(repeated):
+            raise ValueError(f'Route {ids[repeated[0] // num_nodes]}->{ids[repeated[0] % num_nodes]} is listed more than once.')
+        seen[flat] = True
+        for dist_type in ['Total', 'Inside', 'Outside']:
+            matrices[f'distance_{dist_type.lower()}'][flat] = (1000 * routes[f'Distance{dist_type}[km]'].to_numpy(dtype=float)).astype(int32)
+        matrices['time_routes'][flat] = times_to_int(routes['Duration[s]'].values)
+        first_row += len(routes.index)
+
+    missing = flatnonzero(~seen)
+    if (missing // num_nodes != missing % num_nodes).any():
+        arc = missing[missing // num_nodes != missing % num_nodes][0]
+        raise ValueError(f'Route {ids[arc // num_nodes]}->{ids[arc % num_nodes]} is missing.\nRoutes must cover all From x To node pairs.')
+    return {name: matrix.reshape(num_nodes, num_nodes) for name, matrix in matrices.items()}
 
 
 # Function to get processing times for each node
 def get_time_list_from_nodes(nodes):
-    # Returns list of times taken for serving each node in nodes
-    time_list = nodes['Duration']
-    s_list = [time_to_int(x) for x in time_list]
-    return s_list
-
-
-# Function to write output data from routing to CSV file
-def write_to_csv(csv, city, toll, timeout, time, routes):
-    data_out = {
-            'City': [city],
-            'Toll [ct]': [toll],
-            'Construction heuristic': [csv[5]],
-            'Metaheuristic': [csv[6]],
-            'Max_Time [s]': [timeout],
-            'Actual_Time [s]': [time],
-            'Total_Cost [€]': [csv[0]],
-            'Fleet': [csv[1]],
-            'Total_Weight [kg]': [csv[2]],
-            'Total_Volume [m3]': [csv[3]],
-            'Total_Distance [km]': [csv[4]],
+    # Returns array of times taken for serving each node in nodes
+    return times_to_int(nodes['Duration'].values).astype(int32)
+
+
+# Function to collect output data from routing into one CSV row
+def get_csv_row(csv, city, toll, timeout, time, routes):
+    return {
+            'City': city,
+            'Toll [ct]': toll,
+            'Construction heuristic': csv[5],
+            'Metaheuristic': csv[6],
+            'Max_Time [s]': timeout,
+            'Actual_Time [s]': time,
+            'Stop_Reason': csv[12] if len(csv) > 13 else '',
+            'Search_Time [s]': csv[13] if len(csv) > 13 else '',
+            'First_Solution [s]': csv[11][0]['Time [s]'] if len(csv) > 11 and csv[11] else '', # Time into the search, not a phase
+            'Total_Cost [€]': csv[0],
+            'Fleet': csv[1],
+            'Total_Weight [kg]': csv[2],
+            'Total_Volume [m3]': csv[3],
+            'Total_Distance [km]': csv[4],
             'Routes': routes
-        }
-    try:
-        df = DataFrame(data_out)
-        df.to_csv(f'output/{city}_{toll}_{timeout}_FSS{csv[5]}_LSS{csv[6]}.csv', index=False, sep=';')
-    except Exception as e:
-        return f'Error: {e}\n'
-    return 'Output written to CSV file\n'
+        } | ({get_phase_column(phase): round(value, 4) if value is not None else '' for phase, value in csv[14].items()} if len(csv) > 14 else {}) | ({'Portfolio_Winner': csv[15]} if len(csv) > 15 else {})
+
+
+# Function to get the CSV column of a phase timing, e.g. 'Data model [s]' -> 'Data_Model [s]'
+def get_phase_column(phase):
+    name, unit = phase.rsplit(' ', 1)
+    return '_'.join(word[0].upper() + word[1:] for word in name.split()) + f' {unit}'
 
 
 # Function to perform sanity check on user-defined parameters to avoid running impossible searches
@@ -124,6 +254,78 @@ def check_infeasibility(vehicle_weights, vehicle_volumes, demand_weights, demand
         return False, ''
 
 
+# Function to get the shortest travel from the depot (node 0) to each node and back through any nodes
+# This is a lower bound of every route that visits the node, even where the matrix violates the triangle inequality
+def get_depot_round_trips(matrix):
+    matrix = asarray(matrix, dtype=int64)
+    return get_shortest_from_depot(matrix) + get_shortest_from_depot(matrix.T)
+
+
+# Function to get the shortest travel from the depot (node 0) to each node (Dijkstra on the dense matrix, O(n^2) in NumPy steps of n)
+def get_shortest_from_depot(matrix):
+    shortest = matrix[0].copy()
+    shortest[0] = 0
+    done = zeros(len(matrix), dtype=bool)
+    done[0] = True
+    for _ in range(len(matrix)-1):
+        node = where(done, iinfo(int64).max, shortest).argmin()
+        done[node] = True
+        shortest = minimum(shortest, shortest[node] + matrix[node])
+    return shortest
+
+
+# Function to find customers or fleet-wide limits that make a search impossible, before running it (milliseconds instead of the full time limit)
+# Vehicles are given by type and limits per vehicle, nodes by demands, service times and matrices (node 0 is the depot)
+# Returns True and the output naming the node/constraint at fault, or False and '' like check_infeasibility()
+def check_node_infeasibility(vehicle_types, vehicle_weights, vehicle_volumes, vehicle_ranges, demand_weights, demand_volumes, service_times, distances, times, max_time, ids):
+    def impossible(message, reason):
+        return True, ['No solution possible!', '', message, '', 'No solution possible!', '', f'No solution possible due to {reason}', False]
+
+    # Every customer needs one vehicle that can carry its weight and volume and reach it within range and time
+    vehicle_types, vehicle_weights, vehicle_volumes, vehicle_ranges = asarray(vehicle_types), asarray(vehicle_weights), asarray(vehicle_volumes), asarray(vehicle_ranges)
+    round_trip_distances = get_depot_round_trips(distances)
+    round_trip_times = get_depot_round_trips(asarray(times) + asarray(service_times)[None, :])
+    fits = ((asarray(demand_weights)[:, None] <= vehicle_weights[None, :]) & (asarray(demand_volumes)[:, None] <= vehicle_volumes[None, :])
+            & (round_trip_distances[:, None] <= vehicle_ranges[None, :]) & (round_trip_times[:, None] <= max_time))
+    fits[0] = True # Depot
+    for node in flatnonzero(~fits.any(axis=1)):
+        customer = f'Customer {ids[node]} (node {node}, {demand_weights[node]/1000}kg, {demand_volumes[node]/1000}m3, round trip {round_trip_distances[node]/1000}km in {int_to_time(round_trip_times[node])})'
+        if round_trip_times[node] > max_time:
+            return impossible(f'{customer} cannot be reached and served within the maximum route time of {int_to_time(max_time)}', f'customer {ids[node]} being out of reach in time')
+        reasons = []
+        for vehicle_type in sorted(set(vehicle_types.tolist())):
+            vehicle = flatnonzero(vehicle_types == vehicle_type)[0]
+            if demand_weights[node] > vehicle_weights[vehicle]:
+                reasons.append(f'Type {vehicle_type}: payload {vehicle_weights[vehicle]/1000}kg')
+            elif demand_volumes[node] > vehicle_volumes[vehicle]:
+                reasons.append(f'Type {vehicle_type}: volume {vehicle_volumes[vehicle]/1000}m3')
+            else:
+                reasons.append(f'Type {vehicle_type}: range {vehicle_ranges[vehicle]/1000}km')
+        return impossible(f'{customer} cannot be served by any vehicle of the fleet\n' + '\n'.join(reasons), f'customer {ids[node]} fitting no vehicle')
+
+    # Customers heavier (bulkier) than half of the largest vehicle can never share one, so the k-th largest of them needs k vehicles that carry it
+    for demands, capacities, unit, scale, name in [(demand_weights, vehicle_weights, 'kg', 1000, 'weight'), (demand_volumes, vehicle_volumes, 'm3', 1000, 'volume')]:
+        demands = asarray(demands)
+        big = flatnonzero(demands[1:] * 2 > capacities.max()) + 1
+        big = big[demands[big].argsort()[::-1]]
+        for k, node in enumerate(big):
+            carriers = (capacities >= demands[node]).sum()
+            if carriers < k+1:
+                return impossible(f'{k+1} customers with more than half of the largest {name} capacity ({capacities.max()/2/scale}{unit}) each need their own vehicle, '
+                                  f'but only {carriers} vehicles can carry the smallest of them (customer {ids[node]}, {demands[node]/scale}{unit})', f'too few vehicles for large {name} demands')
+
+    # Every customer is entered by one arc at least as long as its shortest incoming arc, so routes cannot be shorter/faster than the sums of those
+    incoming_distances = asarray(distances, dtype=int64) + (arange(len(distances))[:, None] == arange(len(distances))[None, :]) * 2**40 # Exclude self-loops
+    incoming_times = asarray(times, dtype=int64) + (arange(len(times))[:, None] == arange(len(times))[None, :]) * 2**40
+    needed_distance = incoming_distances.min(axis=0)[1:].sum() + incoming_distances[1:, 0].min()
+    needed_time = (incoming_times.min(axis=0)[1:] + asarray(service_times)[1:]).sum() + incoming_times[1:, 0].min()
+    if needed_distance > vehicle_ranges.sum():
+        return impossible(f'Visiting all customers takes at least {needed_distance/1000}km > Total range of the fleet {vehicle_ranges.sum()/1000}km', 'insufficient range')
+    if needed_time > len(vehicle_types) * max_time:
+        return impossible(f'Visiting and serving all customers takes at least {int_to_time(needed_time)} > {len(vehicle_types)} vehicles with {int_to_time(max_time)} each', 'insufficient time')
+    return False, ''
+
+
 # Function to get correct index for solver from strategy name
 def get_fss(new_fss):
     match new_fss:
@@ -137,6 +339,8 @@ def get_fss(new_fss):
             fss = routing_enums_pb2.FirstSolutionStrategy.EVALUATOR_STRATEGY
         case 'Savings':
             fss = routing_enums_pb2.FirstSolutionStrategy.SAVINGS
+        case 'NumPy Savings':
+            fss = routing_enums_pb2.FirstSolutionStrategy.AUTOMATIC # Only used if the savings plan of route_planning.get_savings_routes() cannot be used
         case 'Sweep':
             fss = routing_enums_pb2.FirstSolutionStrategy.SWEEP
         case 'Christofides':
@@ -175,40 +379,64 @@ def get_lss(new_lss):
             lss = routing_enums_pb2.LocalSearchMetaheuristic.GENERIC_TABU_SEARCH
     return lss
 
+max_legend_routes = 20 # Plans with more routes get one legend entry per vehicle type
+
 # Function to visualise routes taken and adapted from LiveCoding code by Gerhard Hiemann
-# Each vehicle type should be plotted in a different base colour with variations between vehicles 
-def draw_routes(types: list[int], types_seq: list[int], routes: list[list[int]], nodes: dict, city: str):
+# Each vehicle type should be plotted in a different base colour with variations between vehicles
+# Coordinates of all routes are gathered at once and each vehicle type is drawn as one line collection
+# Without path the map opens in a window (GUI); with path it is rendered headless (Agg for .png, SVG for .svg) and saved there, e.g. by sweeps
+def draw_routes(types: list[int], types_seq: list[int], routes: list[list[int]], nodes: dict, city: str, path: str = None):
+    # Only imported when plotting, as matplotlib takes longer to load than everything else (see gui.py)
+    from matplotlib import colormaps
+    from matplotlib.collections import LineCollection
+    from matplotlib.lines import Line2D
+
     # Keep track of how many types have been seen already / where in the color scheme we are
     # Start all at 3, to avoid getting very light line colours on white background
     types_seen = [3, 3, 3, 3, 3, 3, 3]
 
     # Define colour schemes for vehicles (plus 6 to skip first and last three entries as they are too light/dark to distinguish)
-    colors = [plt.cm.get_cmap('Greys', types[0]+6),
-        plt.cm.get_cmap('Reds', types[1]+6),
-        plt.cm.get_cmap('RdPu', types[2]+6),
-        plt.cm.get_cmap('Greens', types[3]+6),
-        plt.cm.get_cmap('Blues', types[4]+6),
-        plt.cm.get_cmap('Purples', types[5]+6),
-        plt.cm.get_cmap('cool', types[6]+6)]
+    colors = [colormaps[name].resampled(count+6) for name, count in zip(['Greys', 'Reds', 'RdPu', 'Greens', 'Blues', 'Purples', 'cool'], types)]
+    route_colors = []
+    for vtype in types_seq:
+        route_colors.append(colors[vtype-1](types_seen[vtype-1]))
+        types_seen[vtype-1] += 1
 
     time = strftime('%H:%M:%S', localtime())
-    fig, ax = plt.subplots(num=f'Routes calculated for {city} at {time}')
-    fig.tight_layout()
-    ax.axis('equal')
-    plt.tick_params(axis='x', which='both', bottom=False, top=False, labelbottom=False)
-    plt.tick_params(axis='y', which='both', right=False, left=False, labelleft=False)
-
-    for id, route in enumerate(routes):
-        path = list()
-        for node in range(len(route)):
-            path.append((nodes.Lon.iat[route[node]], nodes.Lat.iat[route[node]]))
-        # plot control points and connecting lines
-        x, y = zip(*path)
-        vtype = types_seq[id]
-        line, = ax.plot(x, y, 'o-', color=colors[vtype-1](types_seen[vtype-1]), label=f'{id+1}: {vtype}')
-        types_seen[vtype-1] += 1
-    plt.legend(loc='center right', bbox_to_anchor=(0.15, 0.5), bbox_transform=fig.transFigure)
+    if path is None:
+        import matplotlib.pyplot as plt
+        fig = plt.figure(num=f'Routes calculated for {city} at {time}')
+    else:
+        from matplotlib.figure import Figure # Not registered with pyplot, so no GUI backend is involved and worker threads/processes can render in parallel
+        fig = Figure()
+    ax = fig.subplots()
+    ax.set_aspect('equal', adjustable='datalim')
+    ax.tick_params(axis='x', which='both', bottom=False, top=False, labelbottom=False)
+    ax.tick_params(axis='y', which='both', right=False, left=False, labelleft=False)
+
+    # Gather the coordinates of all route nodes in one indexing operation and split them into routes again
+    lengths = [len(route) for route in routes]
+    points = asarray([nodes.Lon.values, nodes.Lat.values], dtype=float).T[concatenate(routes).astype(int64)] if routes else zeros((0, 2))
+    paths = [points[end-length:end] for length, end in zip(lengths, asarray(lengths, dtype=int64).cumsum())]
+    for vtype in sorted(set(types_seq)):
+        ids = [id for id, route_type in enumerate(types_seq) if route_type == vtype]
+        ax.add_collection(LineCollection([paths[id] for id in ids], colors=[route_colors[id] for id in ids]))
+    ax.scatter(points[:, 0], points[:, 1], s=12, c=[color for color, length in zip(route_colors, lengths) for _ in range(length)], zorder=3)
+    ax.autoscale_view()
+
+    # Legend entry per route, or per vehicle type for large plans (laying out a long legend takes longer than drawing all routes)
+    if len(routes) <= max_legend_routes:
+        handles = [Line2D([], [], marker='o', color=route_colors[id], label=f'{id+1}: {vtype}') for id, vtype in enumerate(types_seq)]
+    else:
+        handles = [Line2D([], [], marker='o', color=colors[vtype-1](types_seen[vtype-1]-1), label=f'{vtype}: {list(types_seq).count(vtype)} routes') for vtype in sorted(set(types_seq))]
+    ax.legend(handles=handles, loc='center right', bbox_to_anchor=(0.15, 0.5), bbox_transform=fig.transFigure)
     for pos in ['right', 'top', 'bottom', 'left']:
-        plt.gca().spines[pos].set_visible(False)
-        
-    plt.show(block=False)
\ No newline at end of file
+        ax.spines[pos].set_visible(False)
+
+    if path is None:
+        fig.tight_layout()
+        plt.show(block=False)
+        return None
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fig.savefig(path, bbox_inches='tight', dpi=150)
+    return path